@@ -0,0 +1,200 @@
+import argparse
+import asyncio
+import data
+import formatting as fmt
+import json
+import lexicon
+import library
+import os
+import random
+import re
+import solver
+import sql
+import subprocess
+import tempfile
+import time
+
+from instances import BoggleInstance, UnscrambleInstance
+
+def boards(size, n, seed=0):
+    '''[n] fixed seeded boards of [size]'''
+    rng = random.Random(seed)
+    return [BoggleInstance.roll(size, rng)[1] for _ in range(n)]
+
+def timeit(func, args, repeat=3):
+    '''Best total time of calling [func] on every item of [args], over [repeat] runs'''
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for arg in args:
+            func(arg)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_data():
+    '''Opening every compiled word list, and compiling one from scratch.'''
+    results = {}
+    for name, wordlist, fresh in (('hard', data.hard, lambda: data.WordList('hard', data.files['words'], 4, sort=True)),
+                                  ('anagrams', data.hard.anagrams(), lambda: data.AnagramIndex(data.hard)),
+                                  ('ranked', data.ranked, lambda: data.RankIndex('ranked', data.ranked.sources, 4))):
+        wordlist.load()
+        results[f'open_{name}'] = timeit(lambda _: len(fresh()), [None])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        def compile_(_):
+            wordlist = data.WordList('medium', data.files['medium'], 4)
+            wordlist.path = os.path.join(tmp, 'medium.list')
+            wordlist.compile()
+        results['compile_medium'] = timeit(compile_, [None], repeat=1)
+
+    results['open_lexicon'] = timeit(lambda _: lexicon.Lexicon.load(), [None])
+    return results
+
+def solve_original(board, words):
+    '''
+    The solver the bot started with, kept as the reference of bench_solver: filter [words]
+    (a set) by the letters of [board] with a regex, build every prefix, then search the board.
+    '''
+    size = len(board)
+    bogglable = re.compile(f'[{"".join(set("".join(board)))}]{{3,}}$', re.I).match
+    words = {word for word in words if bogglable(word)}
+    prefixes = {word[:i] for word in words for i in range(2, len(word)+1)}
+
+    def extending(prefix, path):
+        if prefix in words:
+            yield prefix
+        x, y = path[-1]
+        for nx in range(max(0, x-1), min(x+2, size)):
+            for ny in range(max(0, y-1), min(y+2, size)):
+                if (nx, ny) not in path:
+                    prefix1 = prefix + board[ny][nx]
+                    if prefix1 in prefixes:
+                        yield from extending(prefix1, path + ((nx, ny),))
+
+    return {word for y, row in enumerate(board) for x, letter in enumerate(row)
+            for word in extending(letter, ((x, y),))}
+
+def bench_solver(n=50, original=5):
+    '''
+    BoggleInstance.solve_board on fixed seeded boards of every size, against the recursive
+    lexicon walk and, on the first [original] boards, the original regex/prefix-set solver.
+    '''
+    lex = lexicon.get()
+    with open(data.files['words'], 'r') as file:
+        words = {line.strip('\n') for line in file}
+    instance = BoggleInstance(None, None)
+    results = {}
+    for size in BoggleInstance.explicit:
+        boards_ = boards(size, n, seed=size)
+        for board in boards_:
+            assert set(instance.solve_board(board)) == solver.solve_recursive(board, lex), board
+        for board in boards_[:original]:
+            assert set(instance.solve_board(board)) == solve_original(board, words), board
+
+        results[f'original_{size}x{size}'] = timeit(lambda board: solve_original(board, words),
+                                                    boards_[:original], repeat=1)/original
+        results[f'recursive_{size}x{size}'] = timeit(lambda board: solver.solve_recursive(board, lex), boards_)/n
+        results[f'solve_board_{size}x{size}'] = timeit(instance.solve_board, boards_)/n
+    return results
+
+def bench_table(rows=10000):
+    '''fmt.table and fmt.pages on a large result set.'''
+    rng = random.Random(0)
+    table = [[f'user{i}', ''.join(rng.choices('abcdefghij', k=rng.randint(3, 16))), rng.randint(0, 500)]
+             for i in range(rows)]
+    results = {}
+    for limit in (10, rows):
+        results[f'table_{limit}'] = timeit(lambda _: fmt.table(table, ['Users', 'Best Word', 'Score'], fmt.three, limit=limit),
+                                          [None])
+    results[f'pages_{rows}'] = timeit(lambda _: list(fmt.pages('Round over.', table, ['Users', 'Best Word', 'Score'], fmt.three)),
+                                      [None])
+    return results
+
+def bench_unscramble(n=200):
+    '''UnscrambleInstance.new_round of every difficulty and a narrow band, indexes already compiled.'''
+    random.seed(0)
+    data.hard.anagrams().load()
+    results = {}
+    for name, config in [*((difficulty, {'difficulty': difficulty}) for difficulty in UnscrambleInstance.difficulties),
+                         ('band', {'length': [7, 7], 'rank': [2000, 20000]})]:
+        instance = UnscrambleInstance(None, None, config)
+        results[f'new_round_{name}'] = timeit(lambda _: instance.new_round(), range(n))/n
+    return results
+
+def bench_library(n=200):
+    '''BoardLibrary.sample of every difficulty, against db/boards.db if it was generated.'''
+    lib = library.BoardLibrary()
+    results = {}
+    loop = asyncio.new_event_loop()
+    for size in sorted(lib.sizes):
+        for difficulty in (None, *lib.levels):
+            sample = lambda _: loop.run_until_complete(lib.sample(size, 0, difficulty))
+            results[f'sample_{size}x{size}_{difficulty or "any"}'] = timeit(sample, range(n))/n
+    loop.run_until_complete(lib.close())
+    loop.close()
+    return results
+
+def bench_stats(users=1000):
+    '''DBHandler.incr and the flush that writes it, against a temporary database.'''
+    async def run():
+        await sql.DBHandler.incr('boggle', 'wins', [(user, 1) for user in range(users//2)])
+        await sql.DBHandler.incr('boggle', 'losses', [(user, 0) for user in range(users//2, users)])
+        start = time.perf_counter()
+        await sql.DBHandler.flush()
+        return time.perf_counter() - start
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, 'db'))
+        os.chdir(tmp)
+        try:
+            sql.DBHandler.startup()
+            loop = asyncio.new_event_loop()
+            start = time.perf_counter()
+            flush = loop.run_until_complete(run())
+            total = time.perf_counter() - start
+            loop.run_until_complete(sql.DBHandler.shutdown())
+            loop.close()
+        finally:
+            os.chdir(cwd)
+    return {f'incr_{users}': total - flush, f'flush_{users}': flush}
+
+benchmarks = {
+    'data': bench_data,
+    'solver': bench_solver,
+    'table': bench_table,
+    'unscramble': bench_unscramble,
+    'library': bench_library,
+    'stats': bench_stats
+}
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks, every result is in seconds.')
+    parser.add_argument('only', nargs='*', choices=[[], *benchmarks], help='benchmarks to run, all by default')
+    parser.add_argument('--out', default='bench_output.json', help='where to save the results')
+    parser.add_argument('--compare', help='results of a previous run to compare against')
+    args = parser.parse_args()
+
+    previous = {}
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            previous = json.load(file)['results']
+
+    results = {}
+    for name in args.only or benchmarks:
+        results[name] = benchmarks[name]()
+        for key, seconds in results[name].items():
+            line = f'{name}.{key}: {seconds*1000:.3f}ms'
+            if key in previous.get(name, {}):
+                line += f' ({seconds/previous[name][key]:.2f}x of {args.compare})'
+            print(line)
+
+    with open(args.out, 'w') as file:
+        json.dump({'commit': commit(), 'time': time.time(), 'results': results}, file, indent=2)
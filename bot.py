@@ -1,47 +1,146 @@
+import argparse
 import discord
+import formatting as fmt
+import data
 import games
+import journal
+import lexicon
+import library
 import logging
+import metrics
+import outbox
+import pool
+import profiler
+import router
+import scheduler
 import sql
+import state
 
-from collections import defaultdict
 from discord.ext import commands
+from util import bounds
+from workers import RemoteInstance, WorkerPool
 
 class RefBot(commands.Bot):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, workers=0, shared=None, owner=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.games = {}
-        self.flags = defaultdict(set)
+        #Which channels have a game and what they are flagged with, shared with the other
+        #bot processes (eg. one per shard) through the [shared] database if given.
+        self.state = state.SharedState.startup(self.deliver, owner, shared) if shared else state.LocalState()
+        self.router = router.Router()
+        self.outbox = outbox.Outbox()
+        self.boards = pool.BoardPool()
+        self.library = library.BoardLibrary()
+        self.scheduler = scheduler.Scheduler()
+        self.profiler = profiler.Profiler()
+        #With workers, games run in worker processes and this process only routes to them.
+        self.workers = WorkerPool(self, workers) if workers else None
 
         self.cache = sql.Cache.startup(self)
+        #Games running in workers are not journaled. Processes sharing games keep a journal each.
+        self.journal = None if self.workers else journal.Journal.startup(
+            f'db/journal.{self.state.owner}.log' if self.state.shared else None)
         sql.DBHandler.startup()
 
     async def register(self, instance):
         '''If a game is running, it HAS to be in the registry, otherwise it's broken.
-        This function should only be called at the beginning of an instance's life.'''
-        #if instance.ctx.message.channel.id in self.games:
-        #    raise games.ActiveGame('```diff\n- An instance in this channel is already running.'
-        #                            'If not, try running !reset in this channel.```')
+        This function should only be called at the beginning of an instance's life.
+        Raises games.ActiveGame if the channel has a game, maybe in another bot process.'''
+        if not await self.state.claim(instance.ctx.message.channel.id, instance.name):
+            raise games.ActiveGame(games.ACTIVE_GAME)
 
         self.games[instance.ctx.message.channel.id] = instance
+        self.router.register(instance)
 
     async def unregister(self, instance):
         '''If a game is running, it HAS to be in the registry, otherwise it's broken.
         This function should only be called at the end of an instance's life, otherwise
         an error occured.'''
         del self.games[instance.ctx.message.channel.id]
+        self.router.unregister(instance)
+        await self.state.release(instance.ctx.message.channel.id)
+
+    async def start(self, *args, **kwargs):
+        metrics.registry.start()
+        await super().start(*args, **kwargs)
+
+    async def close(self):
+        metrics.registry.stop()
+        self.boards.close()
+        await self.library.close()
+        if self.workers is not None:
+            await self.workers.close()
+        if self.journal is not None:
+            await self.journal.close()
+        await self.state.close()
+        await sql.DBHandler.shutdown()
+        await self.cache.shutdown()
+        await super().close()
+
+    @property
+    def flags(self):
+        '''{flag: {channel id: key}} of the games of this process, kept by the state store'''
+        return self.state.flags
 
     async def add_flag(self, instance, flag):
         '''Flags should only be added or removed by an instance'''
-        self.flags[flag].add(instance.ctx.message.channel.id)
+        self.router.add(instance, flag)
+        await self.state.flag(instance.ctx.message.channel.id, flag,
+                              instance.dm_key() if flag == 'DMable' else None)
 
     async def remove_flag(self, instance, flag):
         '''Flags should only be added or removed by an instance'''
-        self.flags[flag].remove(instance.ctx.message.channel.id)
+        self.router.remove(instance, flag)
+        await self.state.unflag(instance.ctx.message.channel.id, flag)
+
+    def deliver(self, channel, user, content):
+        '''A DM another bot process forwarded to the DMable game of [channel]'''
+        user = sql.CachedUser(*user)
+        self.cache.set('user', user.id, user)
+        instance = self.router.get(channel, 'DMable')
+        if instance is not None:
+            instance.play(user.id, content)
+
+def compile_words():
+    '''Compile the boggle lexicon and the unscramble lists if they are missing or stale, before the
+    bot starts rather than on a first round. The bot and its workers then map them when first used.'''
+    lexicon.get()
+    data.ranked.load()
+    data.hard.anagrams().load()
 
 class Main(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
+    @commands.command(brief='Show the leaderboard of a game.',
+    description='Games: acro, boggle. Order by: wins, losses, ratio. Top: 1 to 500, 10 by default.')
+    async def leaderboard(self, ctx, game:str, order:str = 'wins', top:int = 10):
+        if game not in sql.DBHandler.games or order not in sql.DBHandler.orders:
+            await ctx.send('```diff\n- Usage: !leaderboard <acro|boggle> [wins|losses|ratio] [top]```')
+            return
+
+        rows = await sql.DBHandler.leaderboard(game, order, bounds(1, 500, top))
+        table = ([self.name(userid), wins, losses, fmt.ratio(wins, losses)]
+                 for userid, wins, losses in rows)
+        for page in fmt.pages(f'{game.capitalize()} leaderboard, by {order}.',
+                              table, ['User', 'Wins', 'Losses', 'W/L'], fmt.four):
+            await ctx.send(page)
+
+    @commands.command(brief='Show the statistics of a user.')
+    async def stats(self, ctx, user:discord.User = None):
+        user = user or ctx.author
+        table = []
+        for game in sql.DBHandler.games:
+            wins, losses = await sql.DBHandler.stats(game, user.id)
+            table.append([game, wins, losses, fmt.ratio(wins, losses)])
+        await ctx.send(fmt.header_code(f'Statistics of {user.name}.',
+                                    fmt.table(table, ['Game', 'Wins', 'Losses', 'W/L'], fmt.four),
+                                    'md'))
+
+    def name(self, userid):
+        user = self.bot.cache.get_user(userid)
+        return user.name if user else str(userid)
+
 class Debug(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
@@ -58,16 +157,120 @@ class Debug(commands.Cog):
     async def cache(self, ctx):
         await ctx.send(self.bot.cache)
 
+    @commands.command()
+    async def boards(self, ctx):
+        await ctx.send(self.bot.boards)
+
+    @commands.command()
+    async def library(self, ctx):
+        if not self.bot.library.sizes:
+            await ctx.send(f'```diff\n- No board library at {self.bot.library.path}, run library.py.```')
+            return
+        await ctx.send(fmt.header_code(f'Board library, {self.bot.library.path}.',
+                                    fmt.table(self.bot.library.table(),
+                                              ['Size', 'Boards', 'Hard <', 'Easy >=', 'Words', 'Max score'],
+                                              ('<', '>', '>', '>', '>', '>')),
+                                    'md'))
+
+    @commands.command()
+    async def metrics(self, ctx):
+        await ctx.send(fmt.header_code(f'Metrics, also written to {metrics.registry.path}.',
+                                    fmt.table(metrics.registry.table(),
+                                              ['Metric', 'Count', 'Mean ms', 'p50 ms', 'p99 ms', 'Max ms'],
+                                              ('<', '>', '>', '>', '>', '>')),
+                                    'md'))
+
+    @commands.command(brief='Profile the bot, or the game of a channel.',
+    description='!profile [seconds 1-300] [all|here|channel id] [sample|cprofile]')
+    async def profile(self, ctx, seconds:int = 10, scope:str = 'all', mode:str = 'sample'):
+        instance = None
+        if scope != 'all':
+            channel = ctx.channel.id if scope == 'here' else int(scope) if scope.isdigit() else None
+            instance = self.bot.games.get(channel)
+            if instance is None or isinstance(instance, RemoteInstance):
+                await ctx.send(f'```diff\n- No game runs in this process for {scope}.```')
+                return
+        if mode not in ('sample', 'cprofile'):
+            await ctx.send('```diff\n- Usage: !profile [seconds] [all|here|channel id] [sample|cprofile]```')
+            return
+
+        seconds = bounds(1, 300, seconds)
+        await ctx.send(f'Profiling {instance or "the bot"} for {seconds}s ({mode}).')
+        try:
+            if mode == 'sample':
+                rows, count, path = await self.bot.profiler.sample(seconds, instance)
+                headers, align, counted = ['Function', 'Own', 'Total'], ('<', '>', '>'), 'samples'
+            else:
+                rows, count, path = await self.bot.profiler.cprofile(seconds, instance)
+                headers, align, counted = ['Function', 'Calls', 'Own ms', 'Total ms'], fmt.four, 'calls'
+        except RuntimeError as e:
+            await ctx.send(f'```diff\n- {e}```')
+            return
+        for page in fmt.pages(f'{mode} of {instance or "the bot"}, {count} {counted}, all of it in {path}.',
+                              rows, headers, align):
+            await ctx.send(page)
+
+    @commands.command(brief='What was allocated, and kept, in the next seconds.',
+    description='!allocations [seconds 1-300]')
+    async def allocations(self, ctx, seconds:int = 10):
+        seconds = bounds(1, 300, seconds)
+        await ctx.send(f'Tracing allocations for {seconds}s.')
+        try:
+            rows, size, path = await self.bot.profiler.allocations(seconds)
+        except RuntimeError as e:
+            await ctx.send(f'```diff\n- {e}```')
+            return
+        for page in fmt.pages(f'Allocations, {size/1024:+.1f} KiB in total, all of it in {path}.',
+                              rows, ['Line', 'KiB', 'Blocks'], ('<', '>', '>')):
+            await ctx.send(page)
+
+    @commands.command()
+    async def outbox(self, ctx):
+        await ctx.send(self.bot.outbox)
+
+    @commands.command()
+    async def workers(self, ctx):
+        await ctx.send(self.bot.workers)
+
+    @commands.command()
+    async def timers(self, ctx):
+        await ctx.send(self.bot.scheduler)
+
+    @commands.command()
+    async def journal(self, ctx):
+        await ctx.send(self.bot.journal)
+
     @commands.command()
     async def flags(self, ctx):
         await ctx.send(self.bot.flags)
 
+    @commands.command()
+    async def state(self, ctx):
+        await ctx.send(self.bot.state)
+
+    @commands.command()
+    async def routes(self, ctx):
+        await ctx.send(self.bot.router)
+
 if __name__ == '__main__':
     logging.basicConfig(handlers = [logging.FileHandler('_bot.log', 'w', 'utf-8')],
                         format='%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s',
                         datefmt='%H:%M:%S',
                         level=logging.INFO)
-    bot = RefBot(command_prefix='!', description='Referee Core Bot.')
+    parser = argparse.ArgumentParser(description='Referee Core Bot.')
+    parser.add_argument('--workers', type=int, default=0, help='run the games in this many worker processes')
+    parser.add_argument('--shard', type=int, default=None, help='run only this shard')
+    parser.add_argument('--shards', type=int, default=None, help='number of shards')
+    parser.add_argument('--shared', default=None, help='share games with other bot processes through this database')
+    parser.add_argument('--owner', default=None, help='name of this process in the shared database, '
+                                                      'keep it across restarts to resume its games')
+    args = parser.parse_args()
+
+    compile_words()
+    sharding = {'shard_id': args.shard, 'shard_count': args.shards} if args.shard is not None else {}
+    owner = args.owner or (f'shard-{args.shard}' if args.shard is not None else None)
+    bot = RefBot(command_prefix='!', description='Referee Core Bot.', workers=args.workers,
+                 shared=args.shared, owner=owner, **sharding)
     @bot.event
     async def on_ready():
         print(f'{bot.user.name}: {bot.user.id}')
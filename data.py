@@ -1,16 +1,277 @@
+import logging
+import mmap
+import os
+import random
+import struct
+
+from array import array
+from bisect import bisect_left, bisect_right
+
 files = {
     'words': 'data/words.txt',
     'medium': 'data/medium.txt',
     'easy': 'data/easy.txt'
 }
 
-with open(files['words'], 'r') as file:
-    words = {line.strip('\n') for line in file if len(line) > 3}
+class WordList():
+    '''
+    A word list that is only read the first time it is used.
+
+    The text file is compiled once into data/[name].list: a header, an array of
+    count+1 uint32 offsets and one ascii buffer holding every word back to back.
+    The compiled file is memory-mapped and recompiled whenever the source text changes.
+
+    Behaves like a read-only sequence of str. Only sorted lists support `in`, with a bisect.
+    '''
+    magic = b'WLST'
+    version = 1
+    header = struct.Struct('=4sIQQI4x')
+
+    def __init__(self, name, source, min_length, sort=False):
+        self.name = name
+        self.source = source
+        self.min_length = min_length
+        self.sort = sort
+        self.path = f'data/{name}.list'
+
+        self._buffer = None
+        self._offsets = None
+        self._words = None
+        self._anagrams = None
+
+    def load(self):
+        if self._buffer is None:
+            if not self.open():
+                logging.info(f'Compiling {self.source} into {self.path}')
+                self.compile()
+                self.open()
+        return self
+
+    def open(self):
+        try:
+            with open(self.path, 'rb') as file:
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return False
+
+        try:
+            magic, version, size, mtime, count = self.header.unpack_from(buffer)
+        except struct.error:
+            #Shorter than the header, truncated or corrupt.
+            buffer.close()
+            return False
+        start = self.header.size + (count+1)*4
+        if (magic, version, size, mtime) != (self.magic, self.version, *self.stamp()) or len(buffer) < start:
+            buffer.close()
+            return False
+
+        self._buffer = buffer
+        self._offsets = memoryview(buffer)[self.header.size:start].cast('I')
+        self._words = memoryview(buffer)[start:]
+        return True
+
+    def stamp(self):
+        '''(size, mtime) of the source, the compiled file is stale when they change'''
+        stat = os.stat(self.source)
+        return stat.st_size, stat.st_mtime_ns
+
+    def read(self):
+        with open(self.source, 'r') as file:
+            return [word for word in (line.strip('\n') for line in file)
+                    if len(word) >= self.min_length]
+
+    def compile(self):
+        words = self.arrange(self.read())
+
+        offsets = array('I', [0])
+        for word in words:
+            offsets.append(offsets[-1] + len(word))
+
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as file:
+            file.write(self.header.pack(self.magic, self.version, *self.stamp(), len(words)))
+            file.write(offsets)
+            file.write(''.join(words).encode('ascii'))
+            file.write(self.trailer(words))
+        os.replace(tmp, self.path)
+
+    def trailer(self, words):
+        '''What subclasses keep after the words'''
+        return b''
+
+    def arrange(self, words):
+        '''Order of the words in the compiled file'''
+        return sorted(set(words)) if self.sort else words
+
+    def anagrams(self):
+        '''The AnagramIndex of this list'''
+        if self._anagrams is None:
+            self._anagrams = AnagramIndex(self)
+        return self._anagrams
+
+    def __len__(self):
+        return len(self.load()._offsets) - 1
+
+    def __getitem__(self, i):
+        offsets = self.load()._offsets
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(offsets) - 1
+        if not 0 <= i < len(offsets) - 1:
+            raise IndexError(i)
+        return str(self._words[offsets[i]:offsets[i+1]], 'ascii')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __contains__(self, word):
+        if not self.sort:
+            raise TypeError(f'{self} is not sorted, use a sorted list or the lexicon')
+        i = bisect_left(self, word)
+        return i < len(self) and self[i] == word
+
+    def __repr__(self):
+        return f'WordList({self.name}, loaded={self._buffer is not None})'
+
+def signature(word):
+    '''Anagrams share the same signature, their sorted letters'''
+    return ''.join(sorted(word))
+
+class AnagramIndex(WordList):
+    '''
+    The words of a WordList, compiled to data/[name].anagrams ordered by signature,
+    so every set of anagrams is one contiguous run found with a bisect.
+    '''
+    def __init__(self, wordlist):
+        super().__init__(wordlist.name, wordlist.source, wordlist.min_length)
+        self.path = f'data/{self.name}.anagrams'
+
+    def arrange(self, words):
+        return sorted(set(words), key=lambda word: (signature(word), word))
+
+    def get(self, word):
+        '''Every word of the list with the same letters as [word], as a tuple'''
+        key = signature(word)
+        i = bisect_left(self, key, key=signature)
+        found = []
+        while i < len(self) and signature(self[i]) == key:
+            found.append(self[i])
+            i += 1
+        return tuple(found)
+
+class Band():
+    '''
+    Part of a RankIndex, as [runs] of (start, end) indexes. Sampled in O(1)
+    (a bisect over at most one run per length).
+    '''
+    def __init__(self, index, runs):
+        self.index = index
+        self.runs = [(start, end) for start, end in runs if end > start]
+        self.sizes = []
+        total = 0
+        for start, end in self.runs:
+            total += end - start
+            self.sizes.append(total)
+
+    def sample(self, rng=random):
+        i = rng.randrange(len(self))
+        run = bisect_right(self.sizes, i)
+        before = self.sizes[run-1] if run else 0
+        return self.index[self.runs[run][0] + i - before]
+
+    def __len__(self):
+        return self.sizes[-1] if self.sizes else 0
+
+    def __repr__(self):
+        return f'Band({len(self.runs)} runs, {len(self)} words)'
+
+class RankIndex(WordList):
+    '''
+    The words of several lists, compiled to data/[name].list ordered by (length, rank),
+    so the words of a length within a range of ranks are one contiguous run.
+
+    A word's rank is where it first appears in [sources], read in order: the first
+    source is by frequency, the others add the words it does not have.
+    The ranks follow the words as a uint32 array, then the rank each source starts from.
+    '''
+    def __init__(self, name, sources, min_length):
+        super().__init__(name, sources[0], min_length)
+        self.sources = sources
+        #length: (start, end)
+        self._lengths = None
+        self._ranks = None
+        self._tiers = None
+        #Only while compiling
+        self._ranked = None
+        self._starts = None
+
+    def stamp(self):
+        stats = [os.stat(source) for source in self.sources]
+        return sum(stat.st_size for stat in stats), max(stat.st_mtime_ns for stat in stats)
+
+    def read(self):
+        '''Every word once, by rank'''
+        self._starts = []
+        ranked = {}
+        for source in self.sources:
+            self._starts.append(len(ranked) + 1)
+            with open(source, 'r') as file:
+                for word in (line.strip('\n') for line in file):
+                    if len(word) >= self.min_length and word not in ranked:
+                        ranked[word] = len(ranked) + 1
+        self._ranked = ranked
+        return list(ranked)
+
+    def arrange(self, words):
+        return sorted(words, key=lambda word: (len(word), self._ranked[word]))
+
+    def trailer(self, words):
+        size = self.header.size + (len(words)+1)*4 + sum(map(len, words))
+        ranks = array('I', (self._ranked[word] for word in words))
+        return bytes(-size % 4) + ranks.tobytes() + array('I', self._starts).tobytes()
+
+    def open(self):
+        if not super().open():
+            return False
+        count = len(self._offsets) - 1
+        tiers = 4*len(self.sources)
+        view = memoryview(self._buffer)
+        self._ranks = view[len(view) - tiers - 4*count:len(view) - tiers].cast('I')
+        self._tiers = tuple(view[len(view) - tiers:].cast('I'))
+
+        offsets = self._offsets
+        length = lambda i: offsets[i+1] - offsets[i]
+        self._lengths = {}
+        start = 0
+        while start < count:
+            end = bisect_right(range(count), length(start), lo=start, key=length)
+            self._lengths[length(start)] = (start, end)
+            start = end
+        return True
+
+    def tiers(self):
+        '''The ranks each source adds, as [first, last] ranges'''
+        starts = self.load()._tiers
+        return [[start, end - 1] for start, end in zip(starts, (*starts[1:], len(self) + 1))]
+
+    def lengths(self):
+        '''[shortest, longest] word length'''
+        lengths = self.load()._lengths
+        return [min(lengths), max(lengths)]
+
+    def band(self, lengths, ranks):
+        '''The words of length and rank within the [first, last] ranges [lengths] and [ranks]'''
+        runs = []
+        for length in range(lengths[0], lengths[1] + 1):
+            start, end = self.load()._lengths.get(length, (0, 0))
+            runs.append((bisect_left(self._ranks, ranks[0], start, end),
+                         bisect_right(self._ranks, ranks[1], start, end)))
+        return Band(self, runs)
 
-with open(files['medium'], 'r') as file:
-    medium = tuple(line.strip('\n') for line in file if len(line) >= 5)
+    def rank(self, i):
+        return self.load()._ranks[i]
 
-with open(files['easy'], 'r') as file:
-    easy = tuple(line.strip('\n') for line in file if len(line) >= 5)
-    hard = tuple(word for word in words if len(word) >= 4)
-        
+hard = WordList('hard', files['words'], 4, sort=True)
+ranked = RankIndex('ranked', (files['easy'], files['medium'], files['words']), 4)
@@ -1,11 +1,16 @@
+import itertools
 import math
 
+four = ('<', '>', '>', '>')
 three = ('<', '<', '>')
 two = ('<', '>')
 
 def sec2min(seconds):
     return f'{(seconds/60):.3f}'
 
+def ratio(wins, losses):
+    return f'{wins/max(losses, 1):.2f}'
+
 def header_code(header, code, syntax='css'):
     '''Helper function to format discord messages'''
     return f'{header}\n```{syntax}\n{code}```'
@@ -19,23 +24,68 @@ def acro(acro):
 def phrase(phrase):
     return ' '.join(phrase)
 
-def table(results, headers, align, tablefmt='simple', limit=10, default_width=4):
-    results = results[:limit]
+def column_widths(cells, headers):
+    '''Width of every column, enough for its header and the longest of its [cells]'''
     widths = [len(header) for header in headers]
-    for row in results:
-        for i, cell in enumerate(row):
-            cell = str(cell)
-            if widths[i] < len(cell):
-                widths[i] = len(cell)+1
+    for i, column in enumerate(zip(*cells)):
+        longest = max(map(len, column))
+        if widths[i] < longest:
+            widths[i] = longest+1
+    return widths
+
+def render(cells, headers, align, widths):
+    '''(header line, rule, rows) of [cells] in columns of [widths], the row lines are only made as [rows] is iterated'''
+    template = ' | '.join(f'{{{i}:{align[i]}{width}}}' for i, width in enumerate(widths))
+    rule = '='*(sum(widths)+(len(widths)-1)*3)
+    return template.format(*headers), rule, (template.format(*row) for row in cells)
+
+def lines(results, headers, align, limit=10):
+    '''
+    (header line, rule, rows) of a table of the first [limit] of [results] (all of them if None).
+    Every cell is converted once and every row is formatted with one template,
+    the row lines are only made as [rows] is iterated.
+    '''
+    cells = [[*map(str, row)] for row in itertools.islice(results, limit)]
+    return render(cells, headers, align, column_widths(cells, headers))
+
+def table(results, headers, align, tablefmt='simple', limit=10, default_width=4):
+    header, rule, rows = lines(results, headers, align, limit)
+    return '\n'.join((header, rule, *rows))
+
+def pages(header, results, headers, align, syntax='md', limit=None, size=2000):
+    '''
+    The table of [results] as header_code messages of at most [size] characters, split between rows.
+    Every page repeats the column headers, the first one has [header]. The columns are as wide as
+    the cells of their own page, so a long cell only widens one page. A row too long
+    for a page on its own is cut.
+    '''
+    cells = [[*map(str, row)] for row in itertools.islice(results, limit)]
+    #Nothing but a row can take more than a quarter of a page.
+    title = header[:size//4]
+
+    def fits(count, widths):
+        line = sum(widths)+(len(widths)-1)*3
+        fixed = len(header_code(title, '', syntax)) + 2*min(line, size//4) + 1
+        return fixed + count*(min(line, size - fixed - 1) + 1) <= size
 
-    headers = [' | '.join([f'{header:{align[i]}{widths[i]}}'
-                for i, header in enumerate(headers)])]
-    for row in results:
-        headers.append(' | '.join([f'{str(cell):{align[i]}{widths[i]}}' 
-                        for i, cell in enumerate(row)]))
-    headers.insert(1, '='*(sum(widths)+(len(widths)-1)*3))
+    def message(page, widths):
+        columns, rule, rows = render(page, headers, align, widths)
+        columns, rule = columns[:size//4], rule[:size//4]
+        fixed = len(header_code(title, f'{columns}\n{rule}', syntax))
+        return header_code(title, '\n'.join((columns, rule, *(row[:size - fixed - 1] for row in rows))), syntax)
 
-    return '\n'.join(headers)
+    narrowest = column_widths([], headers)
+    page, widths = [], narrowest
+    for row in cells:
+        grown = [max(width, len(cell)+1) if len(cell) > least else width
+                 for width, least, cell in zip(widths, narrowest, row)]
+        if page and not fits(len(page)+1, grown):
+            yield message(page, widths)
+            title = '(continued)'
+            page, grown = [], column_widths([row], headers)
+        page.append(row)
+        widths = grown
+    yield message(page, widths)
 
 if __name__ == '__main__':
     tablet = [['Abby', 'Worcester Sauce', 72],
@@ -51,3 +101,5 @@ if __name__ == '__main__':
              ['Brit', 'Sugar', 2]]
 
     print(table(tablet, ['Name', 'Condiment', 'Number'], ('<', '<', '>')))
+    for page in pages('Condiments.', tablet*20, ['Name', 'Condiment', 'Number'], ('<', '<', '>'), size=300):
+        print(len(page), page)
@@ -1,11 +1,17 @@
+import asyncio
 import discord
 import instances
+import journal
 import logging
+import metrics
+import sql
 import traceback
 
 from discord.ext import commands
 
 UNEXPECTED_ERROR = 'An unexpected error ({}) occured, if this error persists please contact the author.'
+ACTIVE_GAME = ('```diff\n- An instance in this channel is already running.'
+               'If not, try running !reset in this channel.```')
 
 class ActiveGame(Exception):
     pass
@@ -21,22 +27,42 @@ class Games(commands.Cog):
     async def on_message(self, msg):
         if msg.content == 'stop': await self.bot.logout()
         if msg.author.bot: return
-        if msg.channel.id in self.bot.flags['playable']:
-            self.bot.games[msg.channel.id].play(msg.author.id, msg.content)
-        elif len(self.bot.flags['DMable']) > 0 and isinstance(msg.channel, discord.DMChannel):
-            for channel in self.bot.flags['DMable']:
-                self.bot.games[channel].play(msg.author.id, msg.content)
+        with metrics.timer('referee_dispatch_seconds'):
+            router = self.bot.router
+            if msg.channel.id in router.games:
+                router.join(msg.author.id, msg.channel.id)
+                instance = router.get(msg.channel.id, 'playable')
+                if instance is not None:
+                    instance.play(msg.author.id, msg.content)
+            elif isinstance(msg.channel, discord.DMChannel):
+                played = router.dm(msg.author.id, msg.content)
+                for instance in played:
+                    instance.play(msg.author.id, msg.content)
+                #Games of the other bot processes only get the DMs no game here took.
+                if not played and self.bot.state.shared:
+                    await self.bot.state.forward(msg.author, msg.content)
 
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, reaction):
         if self.bot.user.id == reaction.user_id: return
-        if reaction.channel_id in self.bot.flags['votable']:
-            self.bot.games[reaction.channel_id].vote(reaction.user_id, reaction.emoji.name)
+        with metrics.timer('referee_dispatch_seconds'):
+            instance = self.bot.router.ballot(reaction.message_id)
+            if instance is not None:
+                instance.vote(reaction.user_id, reaction.emoji.name)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_remove(self, reaction):
+        if self.bot.user.id == reaction.user_id: return
+        with metrics.timer('referee_dispatch_seconds'):
+            instance = self.bot.router.ballot(reaction.message_id)
+            if instance is not None:
+                instance.unvote(reaction.user_id, reaction.emoji.name)
 
 
     @commands.command(brief='Start a boggle game.', 
-    description='Valid configurations (json): \n{"rounds":[1,32], "timer":[1,600], "size":[3,9]}')
+    description='Valid configurations (json): \n{"rounds":[1,32], "timer":[1,600], "size":[4,5], '
+                '"min_words":[0,2000], "difficulty":["easy","medium","hard"]}')
     async def boggle(self, ctx, *, config:str = None):
         '''
         Boggle is a word game of 16 or 25 dice.
@@ -74,7 +100,8 @@ class Games(commands.Cog):
         await self.start('acro', ctx, config)
 
     @commands.command(brief='Start an unscramble game.', 
-    description='Valid configurations (json): \n{"rounds":[1,32], "timer":[1,600], "difficulty":["easy","medium","hard"]')
+    description='Valid configurations (json): \n{"rounds":[1,32], "timer":[1,600], "difficulty":["easy","medium","hard"], '
+                '"length":[first,last], "rank":[first,last]}')
     async def unscramble(self, ctx, *, config:str = None):
         '''
         Unscramble is a word game.
@@ -91,35 +118,81 @@ class Games(commands.Cog):
 
         *Names included
         *Words greater than length 4
+
+        "length" picks words of that many letters (eg. [5, 7]), and "rank" words of that
+        frequency rank instead of the difficulty (eg. [1000, 5000], 1 is the most frequent).
         '''
         await self.start('unscramble', ctx, config)
 
     async def start(self, game, ctx, config:str = None):
         '''Start an instance of [game] with json config [config], handling any errors'''
         if ctx.message.channel.id in self.bot.games:
-            await ctx.send(
-            '```diff\n- An instance in this channel is already running.'
-            'If not, try running !reset in this channel.```')
+            self.bot.outbox.send(ctx, ACTIVE_GAME)
+            return
+
+        if self.bot.workers is not None:
+            await self.bot.workers.start(game, ctx, config)
             return
 
         try:
             instance = instances.games[game].make(ctx, self.bot, config)
         except instances.ConfigError as e:
-            await ctx.send(e)
+            self.bot.outbox.send(ctx, e)
             logging.debug(traceback.format_exc())
             return
         except Exception as e:
-            await ctx.send(UNEXPECTED_ERROR.format(e))
+            self.bot.outbox.send(ctx, UNEXPECTED_ERROR.format(e))
             logging.error(traceback.format_exc())
             return
 
+        instance.log('start', game, config, sql.CachedUser.of(ctx.author))
+        await self.run(instance)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        '''Resume the games the journal says were still running before a restart'''
+        if self.bot.journal is None:
+            return
+        for channel_id, records in self.bot.journal.resume().items():
+            asyncio.ensure_future(self.resume(channel_id, records))
+
+    async def resume(self, channel_id, records):
+        _, _, game, config, author = records[0]
+        channel = self.bot.get_channel(channel_id)
+        if channel is None or channel_id in self.bot.games:
+            self.bot.journal.append(channel_id, 'end')
+            return
+
+        ctx = journal.Context(channel, sql.CachedUser(*author))
+        try:
+            instance = instances.games[game].make(ctx, self.bot, config)
+            instance.restore(records[1:])
+        except Exception:
+            self.bot.journal.append(channel_id, 'end')
+            logging.error(traceback.format_exc())
+            return
+
+        self.bot.outbox.send(ctx, f'Resuming the game of {game} interrupted by a restart, from round {instance.first}.')
+        await self.run(instance)
+
+    async def run(self, instance):
+        '''Play [instance] through, it is journaled as over unless the bot stops first'''
+        ctx = instance.ctx
         #register game to Main registry
-        await self.bot.register(instance)
+        try:
+            await self.bot.register(instance)
+        except ActiveGame as e:
+            #Another bot process runs a game there.
+            self.bot.outbox.send(ctx, e)
+            instance.log('end')
+            return
         try:
             async for message in instance.start():
-                await ctx.send(message)
+                #Tables come as a list of pages, see fmt.pages
+                for page in message if isinstance(message, list) else [message]:
+                    self.bot.outbox.send(ctx, page)
         except Exception as e:
-            await ctx.send(UNEXPECTED_ERROR.format(e))
+            self.bot.outbox.send(ctx, UNEXPECTED_ERROR.format(e))
             logging.error(traceback.format_exc())
         finally:
             #Unregister game from Main registry, 
@@ -127,4 +200,5 @@ class Games(commands.Cog):
             #Otherwise, there is an error inside the instance.
             await self.bot.unregister(instance)
             logging.info(f'{instance} successfully unregistered from registry')
+        instance.log('end')
         
@@ -1,12 +1,13 @@
-import asyncio
 import data
 import formatting as fmt
 import json
+import lexicon
+import library
 import logging
 import math
 import random
-import re
 import string
+import solver
 import sql
 import traceback
 
@@ -20,6 +21,11 @@ class NotEnoughPlayers(Exception):
     pass
 
 class Instance():
+    #Where a resumed instance picks up, see restore
+    first = 1
+    resumed = None
+    pending = ()
+
     @classmethod
     def make(cls, ctx, bot, config=None):
         try: 
@@ -44,23 +50,14 @@ class Instance():
             yield self.get_user(key), (key, val)
 
     def get_user(self, userid):
-        if userid in self.bot.cache.mem['user']:
-            return self.bot.cache.mem['user'][userid]
-        else:
-            user = self.bot.get_user(userid)
-            logging.info(f"Creating {userid} in cache :) will delete after 1800secs")
-            self.bot.cache.mem['user'][userid] = user
-            self.bot.loop.create_task(self.bot.cache.t_delete('user', userid))
-            return user
+        return self.bot.cache.get_user(userid)
 
     async def game_over(self):
         try:
             table, winners = await self._game_over()
         except NotEnoughPlayers:
             table, winners = [], 'Not enough players? 😥'
-        return fmt.header_code(f'Game over. {winners}',
-                                    fmt.table(table, ['Users', 'Score'], fmt.two),
-                                    'md')
+        return list(fmt.pages(f'Game over. {winners}', table, ['Users', 'Score'], fmt.two))
 
     async def _game_over(self):
         if len(self.scores) == 0:
@@ -93,6 +90,35 @@ class Instance():
     def play(self, userid, content):
         raise NotImplementedError
 
+    def log(self, kind, *args):
+        '''Journal a change of state, see journal.Journal'''
+        if self.bot.journal is not None:
+            self.bot.journal.append(self.ctx.message.channel.id, kind, *args)
+
+    def restore(self, records):
+        '''
+        Pick up from the journal after a restart. The last journaled round is played again,
+        with the scores it started with and its state, and the plays and votes it got so far
+        are kept pending until catch_up is called on the round.
+        '''
+        self.pending = []
+        for _, kind, *args in records:
+            if kind == 'round':
+                self.first, scores, self.resumed = args
+                self.scores = defaultdict(int, scores)
+                self.pending = []
+            else:
+                self.pending.append((kind, args))
+
+    def catch_up(self, *kinds):
+        '''Apply the pending records of [kinds] to the round that was resumed'''
+        pending, self.pending = self.pending, []
+        for kind, args in pending:
+            if kind in kinds:
+                getattr(self, kind)(*args)
+            else:
+                self.pending.append((kind, args))
+
 ###################################
 #Boggle
 ###################################
@@ -109,8 +135,12 @@ class BoggleInstance(Instance):
         {
         "rounds": 5, (minimum: 1, maximum: 16)
         "timer": 180, (minimum: 10, maximum: 600)
-        "size": 5 (minimum: 3, maximum: 9)
+        "size": 5, (4 or 5, the sizes with dice)
+        "min_words": 0, (minimum: 0, maximum: 2000)
+        "difficulty": null (easy, medium, hard)
         }
+    min_words and difficulty pick boards from the board library, see library.BoardLibrary.
+    A config that no board of the library matches is refused.
     '''
     name = 'boggle'
     score = { 3: 1, 4: 1,
@@ -131,7 +161,9 @@ class BoggleInstance(Instance):
 
     defaults = {"rounds": 3,
                 "timer": 180,
-                "size": 5}
+                "size": 5,
+                "min_words": 0,
+                "difficulty": None}
 
     possible_flags = {}
 
@@ -142,110 +174,121 @@ class BoggleInstance(Instance):
         self.rounds = bounds(1, 16, config.get('rounds', self.defaults['rounds']))
         self.timer =  bounds(10, 600, config.get('timer', self.defaults['timer']))
         self.size =  bounds(3, 9, config.get('size', self.defaults['size']))
+        if self.size not in self.explicit:
+            raise ConfigError(f'''```diff\n-There are only dice for sizes {', '.join(map(str, sorted(self.explicit)))}.```''')
+        self.min_words = bounds(0, 2000, config.get('min_words', self.defaults['min_words']))
+        self.difficulty = config.get('difficulty', self.defaults['difficulty'])
+        if self.difficulty is not None and self.difficulty not in library.BoardLibrary.levels:
+            raise ConfigError('''```diff\n-The difficulty must be one of: easy, medium, hard.```''')
+        if (self.min_words or self.difficulty) and not bot.library.covers(self.size):
+            raise ConfigError(f'''```diff\n-There is no board library for size {self.size}, min_words and difficulty need one.```''')
+        if (self.min_words or self.difficulty) and not bot.library.matches(self.size, self.min_words, self.difficulty):
+            raise ConfigError(f'''```diff\n-No {self.size}x{self.size} board of the library has at least {self.min_words} words'''
+                              f'''{f" and is {self.difficulty}" if self.difficulty else ""}.```''')
 
         self.board = None
         self.words = None
+        self.phase = None
         self.scores = defaultdict(int)
         self.plays = defaultdict(set)
+        self.results = defaultdict(self.result)
         
     async def start(self):
         yield "A game of boggle is starting! See !help boggle if you wish to see the rules."
-        await asyncio.sleep(1)
-        for round_ in range(1,self.rounds+1):
+        if not self.bot.library.covers(self.size):
+            self.bot.boards.fill(self.size)
+        await self.bot.scheduler.sleep(1)
+        for round_ in range(self.first,self.rounds+1):
             warn, timer = self.warning(round_)
             yield warn
-            await asyncio.sleep(timer)
-            self.new_round()
+            await self.bot.scheduler.sleep(timer)
+            await self.new_round()
+            self.log('round', round_, list(self.scores.items()), self.board)
+            self.catch_up('play')
             yield fmt.header_code(f'Boggle! You have {fmt.sec2min(self.timer)} minutes to find words.', 
                                         fmt.board(self.board),
                                         'css',)
             await self.guess_phase()
             table = self.round_over()
-            yield fmt.header_code('Round over.',
-                                        fmt.table(table, ['Users', 'Best Word', 'Score'], fmt.three),
-                                        'md')
-            await asyncio.sleep(timer)
+            yield list(fmt.pages('Round over.', table, ['Users', 'Best Word', 'Score'], fmt.three))
+            await self.bot.scheduler.sleep(timer)
         yield await self.game_over()
 
     @flagger('playable', 'deletable')
     async def guess_phase(self):
-        await asyncio.sleep(self.timer)
+        self.phase = self.bot.scheduler.phase(self.timer)
+        await self.phase
 
     async def stop(self):
         '''To be used to stop, not necessarily end.'''
         return
 
     def play(self, userid, content):
-        self.plays[userid].update(content.lower().split(' '))
-
-    def new_round(self):
+        '''Score every new valid word as it arrives, anything else is dropped'''
+        found = self.plays[userid]
+        for word in content.lower().split():
+            if word in self.words and word not in found:
+                found.add(word)
+                self.log('play', userid, word)
+                score = self.points(word)
+
+                result = self.results[userid]
+                if len(result['top']) < len(word):
+                    result['top'] = word
+                result['score'] += score
+                self.scores[userid] += score
+
+    async def new_round(self):
         self.plays = defaultdict(set)
-
-        if self.size in self.explicit:
-            dice = self.explicit[self.size]
-
-            distribution = list(range(len(dice)))
-            random.shuffle(distribution)
-
-            flat = ''.join(random.choice(dice[choice]) for choice in distribution).lower()
-            board = tuple(flat[i*self.size:i*self.size+self.size] for i in range(self.size))
-        else:
-            raise NotImplementedError('This config is not yet implemented.')
-
-        self.words = self.solve_board(flat, board)
-        self.board = board
+        self.results = defaultdict(self.result)
+        if self.resumed is not None:
+            self.board, self.resumed = tuple(self.resumed), None
+            self.words = self.solve_board(self.board)
+            return
+
+        sampled = await self.bot.library.sample(self.size, self.min_words, self.difficulty)
+        if sampled is not None:
+            self.board, self.words = sampled
+            return
+        #Boards are solved ahead of time in the board pool, see pool.BoardPool
+        self.board, self.words = await self.bot.boards.get(self.size)
 
     def round_over(self):
-        rounds = defaultdict(lambda: {'top': '', 'score': 0})
-
-        for player, words in self.plays.items():
-            for word in words:
-                if word in self.words:
-                    score = self.score[len(word)] or 11
-
-                    if len(rounds[player]['top']) < len(word):
-                        rounds[player]['top'] = word
-                    self.scores[player] += score
-                    rounds[player]['score'] += score
-
         self.board = None
         self.words = None
 
-        data = [[user, rounds[key]['top'], rounds[key]['score']]
-                 for user, (key, val) in self.get_users(rounds.items())]
+        data = [[user, result['top'], result['score']]
+                 for user, (key, result) in self.get_users(self.results.items())]
         data.sort(key=lambda x: x[-1], reverse=True)
         return data
 
-    #Game-specific helper function
-    def solve_board(self, letters, board):
-        bogglable = re.compile(f'[{"".join(set(letters))}]{{3,}}$', re.I).match
+    #Game-specific helper functions
+    @staticmethod
+    def result():
+        return {'top': '', 'score': 0}
 
-        words = {word for word in data.words if bogglable(word)}
-        prefixes = {word[:i] for word in words for i in range(2, len(word)+1)}
+    @classmethod
+    def points(cls, word):
+        return cls.score.get(len(word), 11)
 
-        return {word for word in self.solve(board, prefixes, words)}
+    def solve_board(self, board):
+        return solver.solve(board)
 
-    def solve(self, board, prefixes, words):
-        for y, row in enumerate(board):
-            for x, letter in enumerate(row):
-                for result in self.extending(letter, board, prefixes, words, ((x, y),)):
-                    yield result
-                
-    def extending(self, prefix, board, prefixes, words, path):
-        if prefix in words:
-            yield prefix #(prefix, path)
-        for (nx, ny) in self.neighbors(*path[-1], self.size):
-            if (nx, ny) not in path:
-                prefix1 = prefix + board[ny][nx]
-                if prefix1 in prefixes:
-                    for result in self.extending(prefix1, board, prefixes, words, path + ((nx, ny),)):
-                        yield result
+    @classmethod
+    def roll(cls, size, rng=random):
+        '''Shuffle and roll the dice for a [size]x[size] board, returns (flat, board)'''
+        if size in cls.explicit:
+            dice = cls.explicit[size]
 
-    @staticmethod
-    def neighbors(x, y, size):
-        for nx in range(max(0, x-1), min(x+2, size)):
-            for ny in range(max(0, y-1), min(y+2, size)):
-                yield nx, ny
+            distribution = list(range(len(dice)))
+            rng.shuffle(distribution)
+
+            flat = ''.join(rng.choice(dice[choice]) for choice in distribution).lower()
+            board = tuple(flat[i*size:i*size+size] for i in range(size))
+        else:
+            raise NotImplementedError('This config is not yet implemented.')
+
+        return flat, board
 
     #Magic
     def __repr__(self):
@@ -304,50 +347,77 @@ class AcroInstance(Instance):
         self.plays = defaultdict(set)
         self.amt = 0
         self.acro = None
-        self.votes = {}
+        self.voting = None
+        self.phase = None
+        self.ballot = None
+        self.reset_votes({})
         
     async def start(self):
         yield "A game of acro is starting! See !help acro if you wish to see the rules."
-        await asyncio.sleep(1)
-        for round_ in range(1,self.rounds+1):
+        await self.bot.scheduler.sleep(1)
+        for round_ in range(self.first,self.rounds+1):
             warn, timer = self.warning(round_)
             yield warn
-            await asyncio.sleep(timer)
+            await self.bot.scheduler.sleep(timer)
             self.new_round()
+            self.log('round', round_, list(self.scores.items()), self.acro)
+            self.catch_up('play')
             yield fmt.header_code(f'Acro! You have {fmt.sec2min(self.timer)} minutes to DM me a phrase.', 
                                 fmt.acro(self.acro),
                                 'css',)
-            await self.phrase_phase()
+            #A round resumed while voting goes back to its vote.
+            if self.voting is None:
+                await self.phrase_phase()
             try:
-                yield await self.voting_phase()
+                yield await self.vote_phase()
             except NotEnoughPlayers:
                 yield fmt.header_code('Round over. No one played? 😢',
                                     fmt.table([], ['React', 'Phrase'], fmt.two),
                                     'md')
-            await asyncio.sleep(timer)
+            await self.bot.scheduler.sleep(timer)
         yield await self.game_over()
 
     @flagger('DMable', 'playable', 'deletable')
     async def phrase_phase(self):
-        await asyncio.sleep(self.timer)
+        self.phase = self.bot.scheduler.phase(self.timer)
+        await self.phase
 
-    @flagger('votable')
-    async def voting_phase(self):
+    async def vote_phase(self):
         table, vote_table, reacts = await self.round_over()
-        msg = await self.ctx.send(fmt.header_code(f'Vote now! You have {fmt.sec2min(self.vote_timer)} minutes.',
-                                    fmt.table(table, ['React', 'Phrase'], fmt.two),
-                                    'md'))
-        for emoji in vote_table:
-            await msg.add_reaction(emoji)
-        await asyncio.sleep(self.vote_timer)
-
-        header, table = await self.vote_over(vote_table, reacts)
-        return fmt.header_code(header,
-                                    fmt.table(table, ['User', 'Phrase', 'Votes'], fmt.three),
-                                    'md')
+        *pages, last = fmt.pages(f'Vote now! You have {fmt.sec2min(self.vote_timer)} minutes.',
+                                 table, ['React', 'Phrase'], fmt.two)
+        for page in pages:
+            self.bot.outbox.send(self.ctx, page)
+        #Votes are the reactions to the last page, the ballot.
+        msg = await self.bot.outbox.send(self.ctx, last)
+        self.ballot = msg.id
+        await self.voting_phase(msg, vote_table)
+        self.ballot = None
+
+        header, table = await self.vote_over(vote_table)
+        return list(fmt.pages(header, table, ['User', 'Phrase', 'Votes'], fmt.three))
+
+    @flagger('votable')
+    async def voting_phase(self, msg, vote_table):
+        #The vote timer runs while the reactions are added.
+        self.phase = self.bot.scheduler.phase(self.vote_timer)
+        reactions = self.bot.outbox.react(msg, vote_table)
+        self.catch_up('vote', 'unvote')
+        self.check_voted()
+        try:
+            await self.phase
+        finally:
+            reactions.cancel()
 
     def new_round(self):
         self.plays = defaultdict(set)
+        self.voting = None
+        if self.resumed is not None:
+            self.acro, self.resumed = list(self.resumed), None
+            for kind, args in self.pending:
+                if kind == 'voting':
+                    self.voting = args[0]
+            return
 
         size = random.randint(min(self.min, self.max), max(self.min, self.max))
         self.acro = [random.choices(string.ascii_lowercase, weights=self.freq)[0] for _ in range(size)]
@@ -359,25 +429,36 @@ class AcroInstance(Instance):
         return await self.vote_start()
 
     async def vote_start(self):
-        self.votes = {}
-
-        reacts = random.choices(self.emojis, k=len(self.plays))
+        reacts = self.voting or random.choices(self.emojis, k=len(self.plays))
+        self.log('voting', reacts)
         data = {reacts[i]: (user, fmt.phrase(phrase)) for i, (user, phrase) in enumerate(self.plays.items())}
         table = [(f'{emoji}​', phrase) for emoji, (user, phrase) in data.items()]
+        self.reset_votes(data)
 
         return table, data, reacts
 
-    async def vote_over(self, vote_table, reacts):
-        if not self.votes: return None
+    def reset_votes(self, candidates):
+        '''
+        Votes are tallied as the reactions come and go, so the result is ready when the vote ends.
+            candidates: the emojis that can be voted for
+            reactions: {user id: {emoji: None}}, the candidates each user reacted with, in order
+            votes: {user id: emoji}, the vote of each user is their last reaction still there
+            tally: {emoji: votes}
+            voted: how many players have a vote
+        '''
+        self.candidates = candidates
+        self.reactions = defaultdict(dict)
+        self.votes = {}
+        self.tally = Counter()
+        self.voted = 0
 
-        reactions = {user: emoji for user, emoji in self.votes.items() if emoji in reacts}
-        if len(reactions) == 0:
+    async def vote_over(self, vote_table):
+        if not self.tally:
             return 'No voters. 😢', []
-        counts = Counter(reactions.values())
-        votes = counts.most_common()
+        most = max(self.tally.values())
         
-        table = [(user, phrase, counts[emoji]) for emoji, (user, (userid, phrase)) in zip(vote_table.keys(), self.get_users(vote_table.values()))]
-        winners = [user for user, phrase, count in table if count == votes[0][1]]
+        table = [(user, phrase, self.tally[emoji]) for emoji, (user, (userid, phrase)) in zip(vote_table.keys(), self.get_users(vote_table.values()))]
+        winners = [user for user, phrase, count in table if count == most]
         
         if len(winners) > 1:
             for winner in winners:
@@ -391,11 +472,57 @@ class AcroInstance(Instance):
         play_ = content.split(' ')
         if self.check_valid(play_):
             self.plays[userid] = play_
+            self.log('play', userid, content)
 
     def vote(self, user, vote):
-        self.votes[user] = vote
+        if vote not in self.candidates:
+            return
+        reactions = self.reactions[user]
+        reactions.pop(vote, None)
+        reactions[vote] = None
+        self.log('vote', user, vote)
+        self.count(user, vote)
+        self.check_voted()
+
+    def unvote(self, user, vote):
+        reactions = self.reactions.get(user)
+        if not reactions or vote not in reactions:
+            return
+        del reactions[vote]
+        self.log('unvote', user, vote)
+        self.count(user, next(reversed(reactions), None))
+
+    def dm_key(self):
+        '''Phrases for this round are routed by their initials, see router.Router'''
+        return ''.join(self.acro)
+
+    def ballot_key(self):
+        '''Reactions are routed by the id of the message they are on, see router.Router'''
+        return self.ballot
     
     #Game-specific helper functions:
+    def count(self, user, vote):
+        '''Move the vote of [user] to [vote], or take it back if None'''
+        previous = self.votes.get(user)
+        if previous == vote:
+            return
+        if previous is not None:
+            self.tally[previous] -= 1
+            if not self.tally[previous]:
+                del self.tally[previous]
+        if vote is not None:
+            self.tally[vote] += 1
+            self.votes[user] = vote
+        else:
+            del self.votes[user]
+        if user in self.plays and (previous is None) != (vote is None):
+            self.voted += 1 if vote is not None else -1
+
+    def check_voted(self):
+        '''End the vote early once everyone who played has voted'''
+        if self.phase is not None and self.voted == len(self.plays):
+            self.phase.finish()
+
     def check_valid(self, acro):
         try:
             if len(acro) != len(self.acro): return False
@@ -404,7 +531,7 @@ class AcroInstance(Instance):
                     return False
             
             return True
-        except TypeError as e:
+        except (TypeError, IndexError) as e:
             logging.info(e)
             return False
 
@@ -419,16 +546,25 @@ class UnscrambleInstance(Instance):
     name = 'unscramble'
     '''
     Class explicit variables:
-    words: {easy: data.easy, hard: data.hard}
+    difficulties: the words of data.ranked each difficulty picks from, by rank
+                  easy: data/easy.txt, the most frequent words
+                  medium: and the rest of data/medium.txt
+                  hard: and the rest of data/words.txt
+    max_answers: words with more anagrams than this are not picked
+    attempts: how many picks or shuffles to try before settling
 
     Config dictionary arguments:
         {
         "rounds": 3, (minimum: 1, maximum: 16)
         "timer": 60, (minimum: 10, maximum: 600)
         "difficulty: 'easy', (easy, medium, hard)
+        "length": [4, 31], (letters, [first, last])
+        "rank": [1, 8813], (frequency rank, [first, last], replaces the ranks of the difficulty)
         }
     '''
-    words = {'easy': data.easy, 'medium': data.medium, 'hard': data.hard}
+    difficulties = ('easy', 'medium', 'hard')
+    max_answers = 2
+    attempts = 16
 
     defaults = {"rounds": 3,
                 "timer": 60,
@@ -442,44 +578,83 @@ class UnscrambleInstance(Instance):
         self.timer =  bounds(10, 600, config.get('timer', self.defaults['timer']))
 
         difficulty = config.get('difficulty', self.defaults['difficulty'])
-        if difficulty not in self.words:
+        if difficulty not in self.difficulties:
             self.difficulty = self.defaults['difficulty']
         else:
             self.difficulty = difficulty
 
+        tiers = data.ranked.tiers()
+        self.lengths = self.span(config, 'length', data.ranked.lengths(), data.ranked.lengths())
+        self.ranks = self.span(config, 'rank', [1, tiers[-1][1]],
+                               [1, tiers[self.difficulties.index(self.difficulty)][1]])
+        #Every round picks from the same band, it is only looked up once.
+        self.band = data.ranked.band(self.lengths, self.ranks)
+        if not len(self.band):
+            raise ConfigError(f'''```diff\n-No word has {self.lengths[0]} to {self.lengths[1]} letters '''
+                              f'''and a rank from {self.ranks[0]} to {self.ranks[1]}.```''')
+
         self.scores = defaultdict(int)
         self.unscrambled = None
         self.scrambled = None
+        self.answers = frozenset()
         self.guess = None
+        self.phase = None
 
     async def start(self):
         yield "A game of unscramble is starting! See !help unscramble if you wish to see the rules."
-        await asyncio.sleep(1)
-        for round_ in range(1,self.rounds+1):
+        await self.bot.scheduler.sleep(1)
+        for round_ in range(self.first,self.rounds+1):
             warn, timer = self.warning(round_)
             yield warn
-            await asyncio.sleep(timer)
+            await self.bot.scheduler.sleep(timer)
             self.new_round()
-            try:
-                yield fmt.header_code(f'Unscramble! You have {fmt.sec2min(self.timer)} minutes to find the word.', 
-                            f'{self.scrambled}',
-                            'css',)
-                await asyncio.wait_for(self.guess_phase(), timeout=self.timer)
-            except asyncio.TimeoutError as e:
-                logging.debug(e)
-            finally:
-                yield self.round_over()
-            await asyncio.sleep(3)
+            self.log('round', round_, list(self.scores.items()), [self.unscrambled, self.scrambled])
+            self.catch_up('play')
+            yield fmt.header_code(f'Unscramble! You have {fmt.sec2min(self.timer)} minutes to find the word.', 
+                        f'{self.scrambled}',
+                        'css',)
+            await self.guess_phase()
+            yield self.round_over()
+            await self.bot.scheduler.sleep(3)
                 
+    @staticmethod
+    def span(config, key, limits, default):
+        '''The [first, last] range of config[key] within [limits], or [default]'''
+        value = config.get(key)
+        if value is None:
+            return default
+        if not (isinstance(value, list) and len(value) == 2 and all(isinstance(end, int) for end in value)):
+            raise ConfigError(f'''```diff\n-{key} must be a range of integers. (eg. {{"{key}": [5, 8]}})```''')
+        return [bounds(*limits, end) for end in sorted(value)]
+
     def new_round(self):
-        self.unscrambled = random.choice(self.words[self.difficulty])
-        self.scrambled = ''.join(random.sample(self.unscrambled,len(self.unscrambled)))
+        #Any word of the dictionary with the same letters is a right answer.
+        anagrams = data.hard.anagrams()
         self.guess = None
+        if self.resumed is not None:
+            (self.unscrambled, self.scrambled), self.resumed = self.resumed, None
+            self.answers = frozenset((self.unscrambled, *anagrams.get(self.unscrambled)))
+            return
+
+        for _ in range(self.attempts):
+            self.unscrambled = self.band.sample()
+            self.answers = frozenset((self.unscrambled, *anagrams.get(self.unscrambled)))
+            if len(self.answers) <= self.max_answers:
+                break
+
+        for _ in range(self.attempts):
+            self.scrambled = ''.join(random.sample(self.unscrambled,len(self.unscrambled)))
+            if self.scrambled not in self.answers and self.scrambled not in lexicon.get():
+                break
 
     @flagger('playable')
     async def guess_phase(self):
-        while self.guess is None:
-            await asyncio.sleep(1)
+        '''Ends at the timer, or as soon as someone guesses correctly'''
+        self.phase = self.bot.scheduler.phase(self.timer)
+        if self.guess is not None:
+            #Guessed before a restart.
+            self.phase.finish()
+        await self.phase
 
     def round_over(self):
         if self.guess:
@@ -492,9 +667,12 @@ class UnscrambleInstance(Instance):
                                 'css',)
 
     def play(self, userid, content):
-        if self.guess is None and content.lower() == self.unscrambled:
+        if self.guess is None and content.lower() in self.answers:
             self.guess = (userid, content)
-            
+            self.log('play', userid, content)
+            if self.phase is not None:
+                self.phase.finish()
+
 
 games = {
     'boggle': BoggleInstance,
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import logging
+import metrics
+import os
+import traceback
+
+class Context():
+    '''All a resumed instance uses of its context'''
+    def __init__(self, channel, author):
+        self.channel = channel
+        self.author = author
+        self.message = self
+
+    async def send(self, content):
+        return await self.channel.send(content)
+
+class Journal():
+    '''
+    Append-only journal of the running instances, so a restart can resume them.
+
+    Records are json lines of [channel id, kind, *args], see Instance.log:
+        start: game, config, author   (Games.start)
+        round: round, scores, state   (every round start, what is needed to play it again)
+        play: user id, content        (plays that changed the state)
+        vote: user id, emoji
+        unvote: user id, emoji        (a vote reaction was removed)
+        voting: reacts                (acro, the emojis the phrases were given)
+        end                           (the game is over, its records can go)
+
+    append() only buffers, so it costs a play next to nothing. One writer task writes
+    what was buffered every [interval] seconds and fsyncs once for all of it (group commit),
+    off the event loop.
+
+    [live] keeps, per channel, the records that are still needed to resume: the start,
+    and everything since the last round started. When a game ends, the next write
+    compacts the file down to [live] instead of appending.
+    '''
+    path = 'db/journal.log'
+    interval = 0.05
+
+    @staticmethod
+    def startup(path=None):
+        '''Read what the previous run left, its unfinished games are in [resumable]'''
+        journal = Journal(path)
+        if os.path.exists(journal.path):
+            with open(journal.path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        journal.fold(json.loads(line))
+                    except ValueError:
+                        #Torn last line of a crash, everything before it was fsynced.
+                        logging.warning(f'Ignoring the rest of {journal.path}: {line!r}')
+                        break
+            journal.rewrite(journal.records())
+        journal.resumable = dict(journal.live)
+        logging.info(f'{len(journal.resumable)} unfinished games in {journal.path}')
+        return journal
+
+    def __init__(self, path=None):
+        self.path = path or self.path
+        self.live = {}
+        self.resumable = {}
+        self.buffer = []
+        self.compact = False
+        self.writer = None
+        self.file = None
+
+    def append(self, channel, kind, *args):
+        record = (channel, kind, *args)
+        self.fold(record)
+        self.buffer.append(record)
+        if self.writer is None or self.writer.done():
+            self.writer = asyncio.ensure_future(self.write())
+
+    def fold(self, record):
+        channel, kind = record[:2]
+        if kind == 'start':
+            self.live[channel] = [record]
+        elif channel not in self.live:
+            return
+        elif kind == 'round':
+            self.live[channel][1:] = [record]
+        elif kind == 'end':
+            del self.live[channel]
+            self.compact = True
+        else:
+            self.live[channel].append(record)
+
+    def records(self):
+        return [record for records in self.live.values() for record in records]
+
+    async def write(self):
+        loop = asyncio.get_event_loop()
+        while self.buffer or self.compact:
+            await asyncio.sleep(self.interval)
+            try:
+                with metrics.timer('referee_journal_write_seconds'):
+                    if self.compact:
+                        self.compact = False
+                        self.buffer = []
+                        await loop.run_in_executor(None, self.rewrite, self.records())
+                    else:
+                        records, self.buffer = self.buffer, []
+                        await loop.run_in_executor(None, self.extend, records)
+            except Exception:
+                logging.error(traceback.format_exc())
+
+    def extend(self, records):
+        if self.file is None:
+            self.file = open(self.path, 'a', encoding='utf-8')
+        self.file.write(''.join(json.dumps(record) + '\n' for record in records))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def rewrite(self, records):
+        '''Replace the journal with [records] alone'''
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as file:
+            file.write(''.join(json.dumps(record) + '\n' for record in records))
+            file.flush()
+            os.fsync(file.fileno())
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        os.replace(tmp, self.path)
+
+    def resume(self):
+        '''{channel id: records} of the unfinished games of the previous run, only given once'''
+        resumable, self.resumable = self.resumable, {}
+        return resumable
+
+    async def close(self):
+        if self.writer is not None and not self.writer.done():
+            await self.writer
+        if self.compact:
+            self.rewrite(self.records())
+        elif self.buffer:
+            self.extend(self.buffer)
+        self.buffer = []
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __repr__(self):
+        return f'Journal({self.path}, live={len(self.live)}, buffered={len(self.buffer)})'
@@ -0,0 +1,200 @@
+import data
+import logging
+import mmap
+import os
+import struct
+
+from array import array
+from collections import deque
+
+class Lexicon():
+    '''
+    A minimized trie (DAWG) of the boggle dictionary, stored as a flat array
+    of uint32 pairs so it can be memory-mapped and shared between processes.
+
+    Every node is a record of two words:
+        mask: bits 0-25 are the letters a-z that have a child, bit 26 marks the end of a word.
+        first: index of the record of the first child.
+    The children of a node are stored contiguously in letter order, so the child for
+    a letter is first + popcount(mask & (bit-1)). Record 0 is the root.
+    '''
+    path = 'data/words.dawg'
+    source = data.files['words']
+
+    magic = b'DAWG'
+    version = 1
+    header = struct.Struct('=4sIQQI4x')
+    final = 1 << 26
+    min_length = 3
+
+    root = 0
+
+    def __init__(self, buffer, nodes):
+        self.buffer = buffer
+        self.nodes = nodes
+
+    @classmethod
+    def load(cls, path=None, source=None):
+        '''Memory-map the compiled lexicon, (re)compiling it first if it is missing or stale.'''
+        path = path or cls.path
+        source = source or cls.source
+
+        lexicon = cls.open(path, source)
+        if lexicon is None:
+            logging.info(f'Compiling {source} into {path}')
+            cls.compile(source, path)
+            lexicon = cls.open(path, source)
+        return lexicon
+
+    @classmethod
+    def open(cls, path, source):
+        try:
+            with open(path, 'rb') as file:
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        stat = os.stat(source)
+        try:
+            magic, version, size, mtime, count = cls.header.unpack_from(buffer)
+        except struct.error:
+            #Shorter than the header, truncated or corrupt.
+            buffer.close()
+            return None
+        if ((magic, version, size, mtime) != (cls.magic, cls.version, stat.st_size, stat.st_mtime_ns)
+                or len(buffer) < cls.header.size + count*8):
+            buffer.close()
+            return None
+
+        nodes = memoryview(buffer)[cls.header.size:cls.header.size+count*8].cast('I')
+        return cls(buffer, nodes)
+
+    @classmethod
+    def compile(cls, source, path):
+        stat = os.stat(source)
+        with open(source, 'r') as file:
+            words = sorted({word for word in (line.strip('\n') for line in file)
+                            if len(word) >= cls.min_length})
+
+        nodes = cls.build(words)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as file:
+            file.write(cls.header.pack(cls.magic, cls.version, stat.st_size, stat.st_mtime_ns, len(nodes)//2))
+            file.write(nodes)
+        #Atomic, so other processes never map a half written file.
+        os.replace(tmp, path)
+
+    @classmethod
+    def build(cls, words):
+        '''Build the flat record array from a sorted iterable of words.
+        Uses incremental minimization (Daciuk et al.), so the full trie never exists in memory.'''
+        root = _Node()
+        register = {}
+        unchecked = []
+        previous = ''
+
+        def minimize(down_to):
+            while len(unchecked) > down_to:
+                parent, letter, child = unchecked.pop()
+                key = child.key()
+                if key in register:
+                    parent.edges[letter] = register[key]
+                else:
+                    register[key] = child
+
+        for word in words:
+            common = 0
+            for a, b in zip(word, previous):
+                if a != b: break
+                common += 1
+            minimize(common)
+
+            node = unchecked[-1][2] if unchecked else root
+            for letter in word[common:]:
+                child = _Node()
+                node.edges[letter] = child
+                unchecked.append((node, letter, child))
+                node = child
+            node.final = True
+            previous = word
+        minimize(0)
+
+        #Give every distinct node with children one contiguous block of child records.
+        blocks = {id(root): 1}
+        size = 1 + len(root.edges)
+        order = []
+        queue = deque([root])
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            for letter, child in sorted(node.edges.items()):
+                if child.edges and id(child) not in blocks:
+                    blocks[id(child)] = size
+                    size += len(child.edges)
+                    queue.append(child)
+
+        nodes = array('I', bytes(size*8))
+        nodes[0], nodes[1] = cls.mask(root), blocks[id(root)]
+        for node in order:
+            start = blocks[id(node)]
+            for i, (letter, child) in enumerate(sorted(node.edges.items())):
+                nodes[2*(start+i)] = cls.mask(child)
+                nodes[2*(start+i)+1] = blocks.get(id(child), 0)
+        return nodes
+
+    @classmethod
+    def mask(cls, node):
+        mask = cls.final if node.final else 0
+        for letter in node.edges:
+            mask |= 1 << (ord(letter)-97)
+        return mask
+
+    def child(self, node, letter):
+        '''Index of the child of [node] along [letter], or None.'''
+        mask = self.nodes[2*node]
+        bit = 1 << (ord(letter)-97)
+        if not mask & bit:
+            return None
+        return self.nodes[2*node+1] + (mask & (bit-1)).bit_count()
+
+    def is_word(self, node):
+        return bool(self.nodes[2*node] & self.final)
+
+    def __contains__(self, word):
+        node = self.root
+        for letter in word:
+            if not 'a' <= letter <= 'z':
+                return False
+            node = self.child(node, letter)
+            if node is None:
+                return False
+        return self.is_word(node)
+
+    def __len__(self):
+        return len(self.nodes)//2
+
+    def __repr__(self):
+        return f'Lexicon({len(self)} nodes)'
+
+class _Node():
+    __slots__ = ('final', 'edges')
+
+    def __init__(self):
+        self.final = False
+        self.edges = {}
+
+    def key(self):
+        return self.final, tuple(sorted((letter, id(child)) for letter, child in self.edges.items()))
+
+_lexicon = None
+
+def get():
+    '''The process-wide lexicon, mapped on first use.'''
+    global _lexicon
+    if _lexicon is None:
+        _lexicon = Lexicon.load()
+    return _lexicon
+
+if __name__ == '__main__':
+    Lexicon.compile(Lexicon.source, Lexicon.path)
+    print(get())
@@ -0,0 +1,166 @@
+import aiosqlite
+import argparse
+import formatting as fmt
+import logging
+import os
+import random
+import solver
+import sqlite3
+import time
+import zlib
+
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+
+def roll_and_score(size):
+    '''Runs in a generator process, returns (board, words, max score, longest word)'''
+    from instances import BoggleInstance
+    _, board = BoggleInstance.roll(size, random.Random())
+    words = sorted(solver.solve(board))
+    return ('/'.join(board), zlib.compress(' '.join(words).encode()), len(words),
+            sum(BoggleInstance.points(word) for word in words), max(map(len, words), default=0))
+
+class BoardLibrary():
+    '''
+    Boggle boards solved offline (python library.py), sampled by word count at the start of a round.
+
+    Each board is stored with its words (zlib'd), word count, maximum score and longest word,
+    indexed by (size, count). A difficulty is a third of the boards of a size by word count,
+    the fewer words the harder. The thresholds, and the word counts the boards of each size
+    have, are read when the library is opened.
+    '''
+    path = 'db/boards.db'
+    levels = ('easy', 'medium', 'hard')
+    batch = 500
+
+    schema = '''CREATE TABLE IF NOT EXISTS boards
+                (id INTEGER PRIMARY KEY, size INTEGER, board TEXT UNIQUE, words BLOB,
+                 count INTEGER, score INTEGER, longest INTEGER)'''
+    indexes = ('CREATE INDEX IF NOT EXISTS boards_count ON boards(size, count)',
+               'CREATE INDEX IF NOT EXISTS boards_score ON boards(size, score)')
+
+    def __init__(self, path=None):
+        self.path = path or self.path
+        #size: number of boards
+        self.sizes = {}
+        #size: (word count of the hardest third, of the easiest third)
+        self.thresholds = {}
+        #size: sorted word counts of its boards
+        self.counts = {}
+        self.con = None
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with sqlite3.connect(self.path) as con:
+            for size, count in con.execute('SELECT size, COUNT(*) FROM boards GROUP BY size'):
+                self.sizes[size] = count
+                self.thresholds[size] = tuple(
+                    con.execute('SELECT count FROM boards WHERE size = ? ORDER BY count LIMIT 1 OFFSET ?',
+                                (size, count*third//3)).fetchone()[0]
+                    for third in (1, 2))
+                self.counts[size] = [count for (count,) in
+                                     con.execute('SELECT DISTINCT count FROM boards WHERE size = ? ORDER BY count', (size,))]
+        logging.info(f'Opened {self}')
+
+    def covers(self, size):
+        return self.sizes.get(size, 0) > 0
+
+    def bounds(self, size, min_words=0, difficulty=None):
+        '''[low, high) word counts of boards of [size] that match'''
+        low, high = min_words, 2**31
+        if difficulty is not None:
+            hard, easy = self.thresholds[size]
+            level = {'hard': (0, hard), 'medium': (hard, easy), 'easy': (easy, 2**31)}[difficulty]
+            low, high = max(low, level[0]), level[1]
+        return low, high
+
+    def matches(self, size, min_words=0, difficulty=None):
+        '''Whether any board of [size] has at least [min_words] words and is of [difficulty]'''
+        if not self.covers(size):
+            return False
+        low, high = self.bounds(size, min_words, difficulty)
+        counts = self.counts[size]
+        i = bisect_left(counts, low)
+        return i < len(counts) and counts[i] < high
+
+    async def sample(self, size, min_words=0, difficulty=None):
+        '''A random (board, words) of [size] with at least [min_words] words and of [difficulty],
+        or None if there is none.'''
+        if not self.covers(size):
+            return None
+        if self.con is None:
+            self.con = await aiosqlite.connect(self.path)
+
+        low, high = self.bounds(size, min_words, difficulty)
+        where = 'WHERE size = ? AND count >= ? AND count < ?'
+        async with self.con.execute(f'SELECT COUNT(*) FROM boards {where}', (size, low, high)) as cursor:
+            (matches,) = await cursor.fetchone()
+        if not matches:
+            return None
+        async with self.con.execute(f'SELECT board, words FROM boards {where} LIMIT 1 OFFSET ?',
+                                    (size, low, high, random.randrange(matches))) as cursor:
+            board, words = await cursor.fetchone()
+        return tuple(board.split('/')), frozenset(zlib.decompress(words).decode().split())
+
+    def generate(self, size, count, workers=None):
+        '''Solve [count] new boards of [size] on every core and add them to the library'''
+        with sqlite3.connect(self.path) as con:
+            con.execute('PRAGMA journal_mode=WAL')
+            con.execute(self.schema)
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                rows = executor.map(roll_and_score, [size]*count, chunksize=64)
+                batch = []
+                for row in rows:
+                    batch.append((size, *row))
+                    if len(batch) >= self.batch:
+                        self.insert(con, batch)
+                        batch = []
+                self.insert(con, batch)
+            for index in self.indexes:
+                con.execute(index)
+        self.sizes.clear()
+        self.thresholds.clear()
+        self.counts.clear()
+        self.load()
+
+    @staticmethod
+    def insert(con, rows):
+        con.executemany('''INSERT OR IGNORE INTO boards (size, board, words, count, score, longest)
+                           VALUES (?, ?, ?, ?, ?, ?)''', rows)
+        con.commit()
+
+    def table(self):
+        '''[size, boards, hard below, easy from, mean words, max score] rows'''
+        rows = []
+        with sqlite3.connect(self.path) as con:
+            for size, boards, mean, score in con.execute('''SELECT size, COUNT(*), AVG(count), MAX(score)
+                                                            FROM boards GROUP BY size'''):
+                rows.append([f'{size}x{size}', boards, *self.thresholds[size], f'{mean:.0f}', score])
+        return rows
+
+    async def close(self):
+        if self.con is not None:
+            await self.con.close()
+            self.con = None
+
+    def __repr__(self):
+        return f'BoardLibrary({self.path}, { {size: count for size, count in self.sizes.items()} })'
+
+if __name__ == '__main__':
+    from instances import BoggleInstance
+    parser = argparse.ArgumentParser(description='Solve boggle boards offline into the board library.')
+    parser.add_argument('--size', type=int, nargs='+', default=[4, 5], choices=sorted(BoggleInstance.explicit))
+    parser.add_argument('--count', type=int, default=10000, help='boards to solve per size')
+    parser.add_argument('--workers', type=int, default=None, help='processes, every core by default')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    library = BoardLibrary()
+    for size in args.size:
+        start = time.perf_counter()
+        library.generate(size, args.count, args.workers)
+        print(f'{args.count} {size}x{size} boards in {time.perf_counter() - start:.1f}s')
+    print(fmt.table(library.table(), ['Size', 'Boards', 'Hard <', 'Easy >=', 'Words', 'Max score'],
+                    ('<', '>', '>', '>', '>', '>'), limit=len(library.sizes)))
@@ -0,0 +1,198 @@
+import argparse
+import asyncio
+import discord
+import formatting as fmt
+import itertools
+import logging
+import metrics
+import os
+import random
+import tempfile
+import time
+
+from bot import RefBot, compile_words
+from games import Games, UNEXPECTED_ERROR
+from instances import AcroInstance
+from outbox import Outbox, FakeTransport
+
+###################################
+#Fake discord objects
+###################################
+class FakeUser():
+    def __init__(self, id, bot=False):
+        self.id = id
+        self.name = f'user{id}'
+        self.discriminator = '0000'
+        self.avatar = None
+        self.bot = bot
+
+    def __str__(self):
+        return f'{self.name}#{self.discriminator}'
+
+class FakeChannel():
+    def __init__(self, id):
+        self.id = id
+
+class FakeDMChannel(discord.DMChannel):
+    '''Passes the isinstance check of Games.on_message'''
+    def __init__(self, id):
+        self.id = id
+
+class FakeMessage():
+    def __init__(self, channel, author, content):
+        self.channel = channel
+        self.author = author
+        self.content = content
+
+class FakeContext():
+    def __init__(self, channel, author):
+        self.channel = channel
+        self.author = author
+        self.message = FakeMessage(channel, author, '')
+
+class FakeEmoji():
+    def __init__(self, name):
+        self.name = name
+
+class FakeReaction():
+    def __init__(self, user_id, channel_id, message_id, emoji):
+        self.user_id = user_id
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.emoji = FakeEmoji(emoji)
+
+###################################
+#Harness
+###################################
+class LoadTest():
+    '''
+    Runs games through Games.start on a RefBot with a FakeTransport, while a driver feeds
+    Games.on_message and Games.on_raw_reaction_add/remove synthetic plays at [rate] per game per second.
+    '''
+    configs = {'boggle': {'rounds': 1, 'timer': 10, 'size': 5},
+               'acro': {'rounds': 1, 'timer': 10, 'vote_timer': 10},
+               'unscramble': {'rounds': 1, 'timer': 10}}
+
+    def __init__(self, counts, rate=1.0, users=1000, latency=0.05, seed=0, workers=0):
+        self.counts = counts
+        self.rate = rate
+        self.rng = random.Random(seed)
+        self.channels = itertools.count(1000)
+
+        self.bot = RefBot(command_prefix='!', workers=workers)
+        self.bot._connection.user = FakeUser(0, bot=True)
+        self.users = {id: FakeUser(id) for id in range(1, users+1)}
+        self.bot.get_user = self.users.get
+        self.players = list(self.users.values())
+        self.transport = FakeTransport(latency)
+        self.bot.outbox = Outbox(self.transport)
+        self.games = Games(self.bot)
+
+        self.sent = 0
+        self.reactions = 0
+
+    async def run(self):
+        tasks = []
+        for game, count in self.counts.items():
+            for _ in range(count):
+                ctx = FakeContext(FakeChannel(next(self.channels)), self.rng.choice(self.players))
+                tasks.append(asyncio.ensure_future(self.games.start(game, ctx, str(self.configs[game]).replace("'", '"'))))
+        driver = asyncio.ensure_future(self.drive())
+
+        start = time.monotonic()
+        await asyncio.gather(*tasks)
+        self.elapsed = time.monotonic() - start
+        driver.cancel()
+        #Let the outbox drain what is left.
+        while self.bot.outbox.drainers:
+            await asyncio.sleep(0.1)
+        await self.bot.close()
+
+    async def drive(self, tick=0.05):
+        owed = 0.0
+        while True:
+            await asyncio.sleep(tick)
+            instances = list(self.bot.games.values())
+            owed += self.rate*tick*len(instances)
+            for _ in range(int(owed)):
+                await self.act(self.rng.choice(instances))
+            owed -= int(owed)
+
+    async def act(self, instance):
+        user = self.rng.choice(self.players)
+        channel = instance.ctx.message.channel
+        router = self.bot.router
+
+        if router.get(channel.id, 'votable') is not None:
+            sent = self.transport.sent[channel.id]
+            message = sent[-1] if sent else None
+            emoji = self.rng.choice(message.reactions or AcroInstance.emojis) if message else '?'
+            reaction = FakeReaction(user.id, channel.id, message.id if message else 0, emoji)
+            await self.games.on_raw_reaction_add(reaction)
+            if self.rng.random() < 0.1:
+                await self.games.on_raw_reaction_remove(reaction)
+            self.reactions += 1
+            return
+
+        content = self.play(instance)
+        if router.get(channel.id, 'DMable') is not None and self.rng.random() < 0.8:
+            channel = FakeDMChannel(user.id)
+        await self.games.on_message(FakeMessage(channel, user, content))
+        self.sent += 1
+
+    def play(self, instance):
+        '''A plausible message for [instance], right or wrong.
+        Instances in workers only show their acronym, they get wrong plays otherwise.'''
+        if instance.name == 'boggle' and getattr(instance, 'words', None):
+            words = list(instance.words)
+            return ' '.join(self.rng.choice(words) if self.rng.random() < 0.5 else 'zzz' for _ in range(3))
+        if instance.name == 'acro' and self.bot.router.get(instance.ctx.message.channel.id, 'DMable'):
+            return ' '.join(letter + 'x' for letter in instance.dm_key())
+        if instance.name == 'unscramble' and getattr(instance, 'unscrambled', None):
+            return instance.unscrambled if self.rng.random() < 0.05 else instance.scrambled
+        return 'hello'
+
+    def errors(self):
+        prefix = UNEXPECTED_ERROR.split('(')[0]
+        return sum(message.content.count(prefix) for sent in self.transport.sent.values() for message in sent)
+
+    def report(self):
+        histograms = metrics.registry.histograms
+        rows = [['games', sum(self.counts.values()), '', ''],
+                ['elapsed s', f'{self.elapsed:.1f}', '', ''],
+                ['messages', self.sent, f'{self.sent/self.elapsed:.1f}/s', ''],
+                ['reactions', self.reactions, f'{self.reactions/self.elapsed:.1f}/s', ''],
+                ['sent', sum(len(sent) for sent in self.transport.sent.values()), '', ''],
+                ['errors', self.errors(), '', '']]
+        for name in ('referee_dispatch_seconds', 'referee_phase_overrun_seconds', 'referee_loop_lag_seconds'):
+            if name in histograms:
+                h = histograms[name]
+                rows.append([name.replace('referee_', '').replace('_seconds', '') + ' ms',
+                             f'{h.sum/max(h.count, 1)*1000:.2f}', f'p99 {h.quantile(0.99)*1000:g}', f'max {h.max*1000:.2f}'])
+        return fmt.table(rows, ['', 'Value', '', ''], ('<', '>', '>', '>'), limit=len(rows))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run many concurrent games headless and report how they hold up.')
+    parser.add_argument('--boggle', type=int, default=100)
+    parser.add_argument('--acro', type=int, default=100)
+    parser.add_argument('--unscramble', type=int, default=100)
+    parser.add_argument('--rate', type=float, default=1.0, help='plays per game per second')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per fake discord call')
+    parser.add_argument('--workers', type=int, default=0, help='run the games in worker processes')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    #Statistics and caches go to a throwaway db/, the word lists are shared.
+    root = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, 'db'))
+        os.symlink(os.path.join(root, 'data'), os.path.join(tmp, 'data'))
+        os.chdir(tmp)
+        compile_words()
+
+        test = LoadTest({'boggle': args.boggle, 'acro': args.acro, 'unscramble': args.unscramble},
+                        args.rate, args.users, args.latency, workers=args.workers)
+        metrics.registry.start()
+        asyncio.get_event_loop().run_until_complete(test.run())
+        print(test.report())
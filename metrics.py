@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import os
+import time
+import traceback
+
+from bisect import bisect_left
+from contextlib import contextmanager
+
+class Histogram():
+    '''Cumulative histogram of seconds, in the prometheus sense.'''
+    buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.counts = [0]*(len(self.buckets)+1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def merge(self, counts, count, sum, max):
+        '''Add what another histogram of the same name observed'''
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, counts)]
+        self.count += count
+        self.sum += sum
+        self.max = self.max if self.max > max else max
+
+    def quantile(self, q):
+        '''Upper bound of the bucket holding the [q] quantile'''
+        rank, seen = q*self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def prometheus(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f'{self.name}_sum {self.sum}')
+        lines.append(f'{self.name}_count {self.count}')
+        return '\n'.join(lines)
+
+class Registry():
+    '''
+    Every histogram of the process, plus the tasks that sample event loop lag
+    every [lag_interval] seconds and write the prometheus text file every [export_interval].
+    '''
+    path = 'metrics.prom'
+    lag_interval = 0.5
+    export_interval = 15
+
+    help = {
+        'referee_solver_seconds': 'Time to roll and solve a boggle board.',
+        'referee_phase_overrun_seconds': 'How late phases end after their deadline.',
+        'referee_db_incr_seconds': 'Time spent in DBHandler.incr.',
+        'referee_db_flush_seconds': 'Time to write a batch of statistics.',
+        'referee_journal_write_seconds': 'Time to write and fsync a batch of journal records.',
+        'referee_dispatch_seconds': 'Time to dispatch a message or reaction to the games.',
+        'referee_loop_lag_seconds': 'Event loop lag, how late a sleep wakes up.'
+    }
+
+    def __init__(self):
+        self.histograms = {}
+        self.tasks = []
+
+    def histogram(self, name):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(name, self.help.get(name, name))
+        return self.histograms[name]
+
+    def observe(self, name, value):
+        self.histogram(name).observe(value)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def drain(self):
+        '''{name: (counts, count, sum, max)} observed since the last drain, see merge'''
+        drained = {name: (h.counts, h.count, h.sum, h.max) for name, h in self.histograms.items() if h.count}
+        self.histograms = {}
+        return drained
+
+    def merge(self, drained):
+        '''Add what the registry of another process drained'''
+        for name, values in drained.items():
+            self.histogram(name).merge(*values)
+
+    def start(self):
+        if not self.tasks:
+            self.tasks = [asyncio.ensure_future(self.sample_lag()),
+                          asyncio.ensure_future(self.export())]
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        self.write()
+
+    async def sample_lag(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.lag_interval)
+            self.observe('referee_loop_lag_seconds', max(0.0, time.monotonic() - start - self.lag_interval))
+
+    async def export(self):
+        while True:
+            await asyncio.sleep(self.export_interval)
+            try:
+                self.write()
+            except Exception:
+                logging.error(traceback.format_exc())
+
+    def write(self, path=None):
+        path = path or self.path
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as file:
+            file.write(self.prometheus())
+        os.replace(tmp, path)
+
+    def prometheus(self):
+        return '\n'.join(histogram.prometheus() for histogram in self.histograms.values()) + '\n'
+
+    def table(self):
+        '''[name, count, mean, p50, p99, max] rows, in milliseconds'''
+        return [[name.replace('referee_', '').replace('_seconds', ''), h.count,
+                 f'{h.sum/max(h.count, 1)*1000:.2f}', f'{h.quantile(0.5)*1000:g}',
+                 f'{h.quantile(0.99)*1000:g}', f'{h.max*1000:.2f}']
+                for name, h in self.histograms.items()]
+
+registry = Registry()
+observe = registry.observe
+timer = registry.timer
@@ -0,0 +1,181 @@
+import asyncio
+import itertools
+import logging
+import time
+import traceback
+
+from collections import Counter, defaultdict, deque
+
+class TokenBucket():
+    '''[burst] tokens, refilled at [rate] tokens per second.'''
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last)*self.rate)
+        self.last = now
+
+    def until_full(self):
+        '''Seconds until the bucket is full again, a full bucket is as good as a new one'''
+        self.refill()
+        return (self.burst - self.tokens)/self.rate
+
+    async def take(self):
+        while True:
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens)/self.rate)
+
+class DiscordTransport():
+    async def send(self, target, content):
+        return await target.send(content)
+
+    async def react(self, message, emoji):
+        await message.add_reaction(emoji)
+
+class FakeMessage():
+    ids = itertools.count(1)
+
+    def __init__(self, channel, content):
+        self.id = next(self.ids)
+        self.channel = channel
+        self.content = content
+        self.reactions = []
+
+    async def add_reaction(self, emoji):
+        self.reactions.append(emoji)
+
+    def __repr__(self):
+        return f'FakeMessage({self.id}, {self.content!r})'
+
+class FakeTransport():
+    '''
+    Keeps everything locally instead of talking to discord, to run games offline.
+    [latency] seconds are spent on every call, like a round trip would.
+    '''
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.sent = defaultdict(list)
+
+    async def send(self, target, content):
+        await asyncio.sleep(self.latency)
+        channel = getattr(target, 'channel', target)
+        message = FakeMessage(channel, content)
+        self.sent[channel.id].append(message)
+        return message
+
+    async def react(self, message, emoji):
+        await asyncio.sleep(self.latency)
+        await message.add_reaction(emoji)
+
+class Outbox():
+    '''
+    Per-channel outbound queue of messages and reactions.
+
+    Consecutive queued messages of a channel are joined into one, up to discord's [limit]
+    of characters. Each channel paces itself with a local token bucket for messages and one
+    for reactions ([rate] per second, up to [burst] at once), so it stays inside discord's
+    rate limits instead of waiting on 429s. Reactions are added in the background.
+    The buckets of a channel are dropped once nothing uses them and they are full again.
+    '''
+    limit = 2000
+    rates = {'messages': (1, 5),
+             'reactions': (4, 1)}
+
+    def __init__(self, transport=None):
+        self.transport = transport or DiscordTransport()
+        self.queues = defaultdict(deque)
+        self.buckets = defaultdict(dict)
+        #channel: drainers and reactions using its buckets
+        self.users = Counter()
+        self.drainers = {}
+
+    def bucket(self, channel, kind):
+        if kind not in self.buckets[channel]:
+            self.buckets[channel][kind] = TokenBucket(*self.rates[kind])
+        return self.buckets[channel][kind]
+
+    def send(self, target, content):
+        '''Queue [content] to [target] (a channel or a context).
+        Returns a future of the message it was sent in, which can be left alone.'''
+        channel = getattr(target, 'channel', target).id
+        future = asyncio.get_event_loop().create_future()
+        #Errors are logged by the drainer, so nobody has to retrieve them.
+        future.add_done_callback(lambda future: future.cancelled() or future.exception())
+        self.queues[channel].append((target, str(content), future))
+
+        if channel not in self.drainers:
+            self.drainers[channel] = asyncio.ensure_future(self.drain(channel))
+        return future
+
+    def react(self, message, emojis):
+        '''Add every emoji of [emojis] to [message] in the background, returns the task'''
+        return asyncio.ensure_future(self._react(message, emojis))
+
+    async def _react(self, message, emojis):
+        channel = message.channel.id
+        bucket = self.bucket(channel, 'reactions')
+        self.users[channel] += 1
+        try:
+            for emoji in emojis:
+                await bucket.take()
+                try:
+                    await self.transport.react(message, emoji)
+                except Exception:
+                    logging.error(traceback.format_exc())
+        finally:
+            self.release(channel)
+
+    async def drain(self, channel):
+        queue = self.queues[channel]
+        bucket = self.bucket(channel, 'messages')
+        self.users[channel] += 1
+        while queue:
+            await bucket.take()
+            target, content, future = queue.popleft()
+            futures = [future]
+            while queue and queue[0][0] is target and len(content) + 1 + len(queue[0][1]) <= self.limit:
+                _, more, future = queue.popleft()
+                content = f'{content}\n{more}'
+                futures.append(future)
+
+            try:
+                message = await self.transport.send(target, content)
+            except Exception as e:
+                logging.error(traceback.format_exc())
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for future in futures:
+                    if not future.done():
+                        future.set_result(message)
+        del self.queues[channel]
+        del self.drainers[channel]
+        self.release(channel)
+
+    def release(self, channel):
+        self.users[channel] -= 1
+        if not self.users[channel]:
+            del self.users[channel]
+            self.prune(channel)
+
+    def prune(self, channel):
+        '''Drop the buckets of [channel] if nothing uses them and they are full, or check again when they are'''
+        if channel in self.users or channel not in self.buckets:
+            return
+        wait = max(bucket.until_full() for bucket in self.buckets[channel].values())
+        if wait > 0:
+            asyncio.get_event_loop().call_later(wait, self.prune, channel)
+        else:
+            del self.buckets[channel]
+
+    def __repr__(self):
+        return (f'Outbox(queued={sum(len(queue) for queue in self.queues.values())}, channels={len(self.drainers)}, '
+                f'buckets={len(self.buckets)})')
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import metrics
+import multiprocessing
+import solver
+import time
+import traceback
+
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+def roll_and_solve(size):
+    '''Runs in a worker process, returns (board, words, seconds it took)'''
+    from instances import BoggleInstance
+    start = time.perf_counter()
+    _, board = BoggleInstance.roll(size)
+    return board, solver.solve(board), time.perf_counter() - start
+
+class BoardPool():
+    '''
+    Pre-solved boggle boards, kept [depth] deep per board size.
+    Boards are rolled and solved in a process pool, so the event loop only ever pops a ready board.
+    '''
+    def __init__(self, depth=4, workers=None):
+        self.depth = depth
+        self.workers = workers
+        self.boards = defaultdict(deque)
+        self.pending = defaultdict(int)
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            #Spawned like the game workers, the bot has threads running by now and forking them is unsafe.
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def fill(self, size):
+        '''Top up the pool of [size] in the background.'''
+        loop = asyncio.get_event_loop()
+        for _ in range(self.depth - len(self.boards[size]) - self.pending[size]):
+            self.pending[size] += 1
+            future = loop.run_in_executor(self.executor, roll_and_solve, size)
+            future.add_done_callback(partial(self._filled, size))
+
+    def _filled(self, size, future):
+        self.pending[size] -= 1
+        if future.cancelled():
+            return
+        try:
+            board, words, elapsed = future.result()
+        except Exception:
+            logging.error(traceback.format_exc())
+        else:
+            metrics.observe('referee_solver_seconds', elapsed)
+            self.boards[size].append((board, words))
+
+    async def get(self, size):
+        '''Pop a ready (board, words) of [size], then refill in the background.'''
+        if self.boards[size]:
+            result = self.boards[size].popleft()
+        else:
+            #Cold pool, wait for a solve without blocking the loop.
+            logging.info(f'Board pool for size {size} is empty')
+            board, words, elapsed = await asyncio.get_event_loop().run_in_executor(self.executor, roll_and_solve, size)
+            metrics.observe('referee_solver_seconds', elapsed)
+            result = board, words
+        self.fill(size)
+        return result
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def __repr__(self):
+        return f'BoardPool({ {size: len(boards) for size, boards in self.boards.items()} })'
@@ -0,0 +1,164 @@
+import asyncio
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+from collections import Counter
+
+def where(code):
+    return f'{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})'
+
+class Sampler(threading.Thread):
+    '''
+    Samples the stack of [thread] every [interval] seconds from a thread of its own.
+    [keep] can drop the stacks that do not matter. Counts how often each function is
+    on the stack (total) and on top of it (own).
+    '''
+    def __init__(self, thread, interval, keep=None):
+        super().__init__(name='referee-sampler', daemon=True)
+        self.thread = thread
+        self.interval = interval
+        self.keep = keep
+        self.samples = 0
+        self.own = Counter()
+        self.total = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread)
+            if frame is None or (self.keep is not None and not self.keep(frame)):
+                continue
+            self.samples += 1
+            self.own[frame.f_code] += 1
+            seen = set()
+            while frame is not None:
+                if frame.f_code not in seen:
+                    seen.add(frame.f_code)
+                    self.total[frame.f_code] += 1
+                frame = frame.f_back
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+class Profiler():
+    '''
+    On demand profiling sessions, one at a time, for the Debug cog.
+
+    A session covers the whole bot, or only [instance]: the sampler then keeps the stacks that
+    go through a method of the instance, and cProfile only runs inside its play and vote.
+    Results are the [top] rows as a table, the full results are written under [path].
+    Nothing is hooked or running while there is no session.
+    '''
+    path = 'profiles'
+    interval = 0.005
+    top = 15
+
+    def __init__(self):
+        self.session = None
+
+    def begin(self, kind):
+        if self.session is not None:
+            raise RuntimeError(f'A {self.session} session is already running.')
+        self.session = kind
+        os.makedirs(self.path, exist_ok=True)
+        return os.path.join(self.path, f'{kind}-{time.strftime("%Y%m%d-%H%M%S")}')
+
+    async def sample(self, seconds, instance=None):
+        '''[function, own %, total %] rows'''
+        path = self.begin('sample')
+        keep = None
+        if instance is not None:
+            keep = lambda frame: self.inside(frame, instance)
+        sampler = Sampler(threading.get_ident(), self.interval, keep)
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await asyncio.get_event_loop().run_in_executor(None, sampler.stop)
+            self.session = None
+
+        samples = max(sampler.samples, 1)
+        codes = sorted(sampler.total, key=lambda code: (sampler.own[code], sampler.total[code]), reverse=True)
+        rows = [[where(code), f'{sampler.own[code]/samples:.1%}', f'{sampler.total[code]/samples:.1%}']
+                for code in codes]
+        with open(f'{path}.txt', 'w') as file:
+            file.write(f'{sampler.samples} samples every {self.interval}s for {seconds}s\n')
+            file.writelines(f'{row[1]:>7} {row[2]:>7} {row[0]}\n' for row in rows)
+        return rows[:self.top], sampler.samples, f'{path}.txt'
+
+    @staticmethod
+    def inside(frame, instance):
+        while frame is not None:
+            if frame.f_locals.get('self') is instance:
+                return True
+            frame = frame.f_back
+        return False
+
+    async def cprofile(self, seconds, instance=None):
+        '''[function, calls, own ms, total ms] rows'''
+        path = self.begin('cprofile')
+        profile = cProfile.Profile()
+        hooked = []
+        if instance is None:
+            profile.enable()
+        else:
+            for name in ('play', 'vote'):
+                if hasattr(instance, name):
+                    setattr(instance, name, self.wrap(profile, getattr(instance, name)))
+                    hooked.append(name)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            if instance is None:
+                profile.disable()
+            for name in hooked:
+                delattr(instance, name)
+            self.session = None
+
+        profile.dump_stats(f'{path}.prof')
+        if not profile.stats:
+            #Nothing was played meanwhile.
+            return [], 0, f'{path}.prof'
+        stats = pstats.Stats(profile)
+        functions = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)
+        rows = [[f'{os.path.basename(file)}:{line}({function})', calls, f'{own*1000:.2f}', f'{total*1000:.2f}']
+                for (file, line, function), (_, calls, own, total, _) in functions[:self.top]]
+        return rows, stats.total_calls, f'{path}.prof'
+
+    @staticmethod
+    def wrap(profile, method):
+        def profiled(*args, **kwargs):
+            return profile.runcall(method, *args, **kwargs)
+        return profiled
+
+    async def allocations(self, seconds):
+        '''[line, KiB, blocks] rows of what was allocated and is still alive after [seconds]'''
+        path = self.begin('allocations')
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        try:
+            before = tracemalloc.take_snapshot()
+            await asyncio.sleep(seconds)
+            after = tracemalloc.take_snapshot()
+        finally:
+            if not tracing:
+                tracemalloc.stop()
+            self.session = None
+
+        diff = after.compare_to(before, 'lineno')
+        with open(f'{path}.txt', 'w') as file:
+            file.writelines(f'{stat}\n' for stat in diff)
+        rows = [[f'{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}',
+                 f'{stat.size_diff/1024:+.1f}', f'{stat.count_diff:+}']
+                for stat in diff[:self.top]]
+        return rows, sum(stat.size_diff for stat in diff), f'{path}.txt'
+
+    def __repr__(self):
+        return f'Profiler(session={self.session})'
@@ -0,0 +1,87 @@
+from collections import defaultdict
+
+class Router():
+    '''
+    Indexes of the running instances, so each message only reaches the games it can affect.
+    Kept up to date by RefBot.register/unregister and the flagger (through RefBot.add_flag/remove_flag).
+
+        games: {channel id: instance}
+        flagged: {flag: {channel id: instance}}
+        dms: {phrase key: {channel id: instance}}, DMable instances by the initials they accept
+        ballots: {message id: instance}, votable instances by the message they are voted on
+        members: {user id: {channel id}}, channels with a game the user has talked in
+    '''
+    def __init__(self):
+        self.games = {}
+        self.flagged = defaultdict(dict)
+        self.dms = defaultdict(dict)
+        self.ballots = {}
+        self.members = defaultdict(set)
+        self.channels = defaultdict(set)
+
+    def register(self, instance):
+        self.games[instance.ctx.message.channel.id] = instance
+
+    def unregister(self, instance):
+        channel = instance.ctx.message.channel.id
+        self.games.pop(channel, None)
+        for user in self.channels.pop(channel, ()):
+            self.members[user].discard(channel)
+            if not self.members[user]:
+                del self.members[user]
+
+    def add(self, instance, flag):
+        channel = instance.ctx.message.channel.id
+        self.flagged[flag][channel] = instance
+        if flag == 'DMable':
+            self.dms[instance.dm_key()][channel] = instance
+        elif flag == 'votable':
+            self.ballots[instance.ballot_key()] = instance
+
+    def remove(self, instance, flag):
+        channel = instance.ctx.message.channel.id
+        self.flagged[flag].pop(channel, None)
+        if flag == 'DMable':
+            key = instance.dm_key()
+            self.dms[key].pop(channel, None)
+            if not self.dms[key]:
+                del self.dms[key]
+        elif flag == 'votable':
+            self.ballots.pop(instance.ballot_key(), None)
+
+    def get(self, channel, flag):
+        '''The instance of [channel] if it is flagged [flag], or None'''
+        return self.flagged[flag].get(channel)
+
+    def ballot(self, message):
+        '''The instance voted on with the reactions to [message], or None'''
+        return self.ballots.get(message)
+
+    def join(self, user, channel):
+        '''[user] talked in [channel], remember it if a game runs there'''
+        if channel in self.games and channel not in self.members[user]:
+            self.members[user].add(channel)
+            self.channels[channel].add(user)
+
+    def dm(self, user, content):
+        '''The DMable instances a DM of [content] from [user] can be a play for'''
+        if not self.dms:
+            return ()
+        candidates = self.dms.get(self.phrase_key(content))
+        if not candidates:
+            return ()
+        if len(candidates) > 1 and self.members.get(user):
+            #Several games accept the same initials, prefer the ones the user takes part in.
+            joined = [instance for channel, instance in candidates.items() if channel in self.members[user]]
+            if joined:
+                return joined
+        return list(candidates.values())
+
+    @staticmethod
+    def phrase_key(content):
+        return ''.join(word[:1].lower() for word in content.split(' '))
+
+    def __repr__(self):
+        return (f'Router(games={len(self.games)}, '
+                f'flagged={ {flag: len(channels) for flag, channels in self.flagged.items()} }, '
+                f'dms={len(self.dms)}, ballots={len(self.ballots)}, members={len(self.members)})')
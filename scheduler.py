@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import math
+import metrics
+import time
+import traceback
+
+class Phase():
+    '''
+    A timed phase of an instance.
+    Ends at its monotonic deadline, or the moment finish() is called.
+    Awaiting a phase returns True if it was finished early.
+    '''
+    def __init__(self, scheduler, timer):
+        self.scheduler = scheduler
+        self.deadline = scheduler.clock() + timer
+        self.done = asyncio.Event()
+        self.early = False
+        self.overrun = 0.0
+
+    def finish(self):
+        '''End the phase now.'''
+        if not self.done.is_set():
+            self.early = True
+            self.scheduler.cancel(self)
+            self.done.set()
+
+    def expire(self, now):
+        self.overrun = now - self.deadline
+        metrics.observe('referee_phase_overrun_seconds', self.overrun)
+        self.done.set()
+
+    @property
+    def remaining(self):
+        return max(0.0, self.deadline - self.scheduler.clock())
+
+    async def wait(self):
+        await self.done.wait()
+        return self.early
+
+    def __await__(self):
+        return self.wait().__await__()
+
+    def __repr__(self):
+        return f'Phase(remaining={self.remaining:.2f}, done={self.done.is_set()})'
+
+class Scheduler():
+    '''
+    A hashed timer wheel that drives the phases of every instance from one task.
+
+    Phases are put in the slot of the tick their deadline falls in. The driver wakes once
+    per tick, on absolute monotonic tick boundaries so it never drifts, and expires the due
+    phases of every slot it has passed. It only runs while there are pending phases.
+    '''
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, tick=0.05, slots=1024):
+        self.tick = tick
+        self.wheel = [set() for _ in range(slots)]
+        self.pending = 0
+        self.cursor = None
+        self.task = None
+
+    def phase(self, timer):
+        '''A new Phase ending in [timer] seconds.'''
+        if self.task is None or self.task.done():
+            self.cursor = math.floor(self.clock()/self.tick)
+            self.task = asyncio.ensure_future(self.run())
+
+        phase = Phase(self, timer)
+        phase.slot = max(math.ceil(phase.deadline/self.tick), self.cursor+1) % len(self.wheel)
+        self.wheel[phase.slot].add(phase)
+        self.pending += 1
+        return phase
+
+    async def sleep(self, timer):
+        '''Like asyncio.sleep, without a timer of its own.'''
+        await self.phase(timer)
+
+    def cancel(self, phase):
+        if phase in self.wheel[phase.slot]:
+            self.wheel[phase.slot].remove(phase)
+            self.pending -= 1
+
+    async def run(self):
+        try:
+            while self.pending:
+                await asyncio.sleep(max(0.0, (self.cursor+1)*self.tick - self.clock()))
+                now = self.clock()
+                current = math.floor(now/self.tick)
+                #Catch up on every tick passed, if the loop was lagging.
+                for tick in range(self.cursor+1, min(current, self.cursor+len(self.wheel))+1):
+                    self.expire(self.wheel[tick % len(self.wheel)], now)
+                self.cursor = current
+        except Exception:
+            logging.error(traceback.format_exc())
+
+    def expire(self, slot, now):
+        due = [phase for phase in slot if phase.deadline <= now]
+        for phase in due:
+            slot.remove(phase)
+            self.pending -= 1
+            phase.expire(now)
+
+    def __repr__(self):
+        return f'Scheduler(pending={self.pending}, tick={self.tick})'
@@ -0,0 +1,94 @@
+import lexicon as lexicon_
+
+from functools import lru_cache
+
+@lru_cache(maxsize=None)
+def neighbors(size):
+    '''Flat neighbor table for a [size]x[size] board, cell i = y*size + x.'''
+    table = []
+    for y in range(size):
+        for x in range(size):
+            table.append(tuple(ny*size + nx
+                               for ny in range(max(0, y-1), min(y+2, size))
+                               for nx in range(max(0, x-1), min(x+2, size))
+                               if (nx, ny) != (x, y)))
+    return tuple(table)
+
+def solve(board, lexicon=None):
+    '''
+    Find every word on [board] (a tuple of rows).
+    Returns {word: path}, where path is a tuple of (x, y) cells, one of the paths that spell the word.
+
+    Iterative depth first search over the lexicon with an explicit stack. Visited cells are
+    kept in an integer bitmask, and every frame only keeps a link to its parent frame, so
+    paths are rebuilt once per word found instead of at every step.
+    '''
+    lexicon = lexicon or lexicon_.get()
+    nodes, final = lexicon.nodes, lexicon.final
+    letters = final - 1
+    size = len(board)
+    flat = ''.join(board)
+    bits = [1 << (ord(letter)-97) for letter in flat]
+    table = [tuple((c, 1 << c, bits[c], flat[c]) for c in adj) for adj in neighbors(size)]
+
+    #frame: (cell, node, visited, parent frame, prefix)
+    frames = []
+    found = {}
+    for start, bit in enumerate(bits):
+        mask = nodes[0]
+        if not mask & bit:
+            continue
+        frames.append((start, nodes[1] + (mask & (bit-1)).bit_count(), 1 << start, -1, flat[start]))
+        stack = [len(frames)-1]
+        while stack:
+            frame = stack.pop()
+            cell, node, visited, _, prefix = frames[frame]
+            mask, first = nodes[2*node], nodes[2*node+1]
+            for nxt, cellbit, bit, letter in table[cell]:
+                if visited & cellbit or not mask & bit:
+                    continue
+                child = first + (mask & (bit-1)).bit_count()
+                childmask = nodes[2*child]
+                if childmask & final:
+                    word = prefix + letter
+                    if word not in found:
+                        found[word] = (frame, nxt)
+                if childmask & letters:
+                    frames.append((nxt, child, visited | cellbit, frame, prefix + letter))
+                    stack.append(len(frames)-1)
+
+    return {word: tuple((c % size, c // size) for c in _path(frames, frame, cell))
+            for word, (frame, cell) in found.items()}
+
+def _path(frames, frame, cell):
+    path = [cell]
+    while frame != -1:
+        cell, _, _, frame, _ = frames[frame]
+        path.append(cell)
+    path.reverse()
+    return path
+
+def solve_recursive(board, lexicon=None):
+    '''The previous recursive solver, kept as a reference for benchmarks.'''
+    lexicon = lexicon or lexicon_.get()
+    size = len(board)
+
+    def extending(prefix, node, path):
+        if lexicon.is_word(node):
+            yield prefix
+        x, y = path[-1]
+        for nx in range(max(0, x-1), min(x+2, size)):
+            for ny in range(max(0, y-1), min(y+2, size)):
+                if (nx, ny) not in path:
+                    letter = board[ny][nx]
+                    child = lexicon.child(node, letter)
+                    if child is not None:
+                        yield from extending(prefix + letter, child, path + ((nx, ny),))
+
+    words = set()
+    for y, row in enumerate(board):
+        for x, letter in enumerate(row):
+            node = lexicon.child(lexicon.root, letter)
+            if node is not None:
+                words.update(extending(letter, node, ((x, y),)))
+    return words
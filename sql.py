@@ -3,14 +3,47 @@ import aiosqlite
 import discord
 import inspect
 import logging
+import metrics
 import sqlite3
+import time
+import traceback
 
-from collections import defaultdict
+from collections import defaultdict, namedtuple, Counter, OrderedDict
+
+class CachedUser(namedtuple('CachedUser', 'id name discriminator avatar')):
+    '''Persisted copy of a discord.User, enough for score tables'''
+    @classmethod
+    def of(cls, user):
+        avatar = getattr(user, 'avatar', None)
+        return cls(user.id, user.name, int(user.discriminator), str(avatar) if avatar else None)
+
+    def __str__(self):
+        return f'{self.name}#{self.discriminator:04}'
+
+class CachedChannel(namedtuple('CachedChannel', 'id type guild_id owner_id')):
+    '''Persisted copy of a discord channel'''
+    @classmethod
+    def of(cls, channel):
+        guild = getattr(channel, 'guild', None)
+        return cls(channel.id, int(getattr(channel.type, 'value', channel.type)),
+                   guild.id if guild else None, getattr(channel, 'owner_id', None))
+
+class CachedServer(namedtuple('CachedServer', 'id name owner_id')):
+    '''Persisted copy of a discord.Guild'''
+    @classmethod
+    def of(cls, guild):
+        return cls(guild.id, guild.name, guild.owner_id)
 
 class Cache():
     '''
     Cache discord results so we do not spam the API.
-    Currently unused.
+
+    Every namespace (eg. 'user') holds at most [size] entries, least recently used
+    first out, and an entry expires [ttl] seconds after it was cached.
+    One sweeper task drops expired entries every [interval] seconds.
+
+    Namespaces with a table in [records] are written through to dbNAME in the background,
+    every [flush_interval] seconds, and loaded back at startup so restarts begin warm.
     '''
     dbNAME = 'db/_cache.db' #do not change unless you know what you're doing
 
@@ -20,23 +53,132 @@ class Cache():
         'servers': "id INTEGER PRIMARY KEY, name TEXT, owner_id INTEGER" 
     }
 
+    #namespace: (table, record)
+    records = {
+        'user': ('users', CachedUser),
+        'channel': ('channels', CachedChannel),
+        'server': ('servers', CachedServer)
+    }
+
+    ttl = 1800
+    size = 10000
+    interval = 60
+    flush_interval = 5
+
     @staticmethod
     def startup(bot):
+        cache = Cache(bot)
         with sqlite3.connect(Cache.dbNAME) as con:
+            con.execute('PRAGMA journal_mode=WAL')
             for table, columns in Cache.tables.items():
                 con.execute(f'CREATE TABLE IF NOT EXISTS {table}({columns})')
-        return Cache(bot)
+            cache.load(con)
+        return cache
+
+    def __init__(self, bot, *args, **kwargs):
+        self.bot = bot
+        #namespace: {id: (expires, value)}, oldest use first
+        self.mem = defaultdict(OrderedDict)
+        self.counters = Counter()
+        self.sweeper = None
 
-    def __init__(self, *args, **kwargs):
-        self.mem = defaultdict(dict)
+        #namespace: {id: record} not yet written to dbNAME
+        self.dirty = defaultdict(dict)
+        self.writer = None
+        self.stopping = None
+        self.con = None
 
-    async def t_delete(self, key, id, timer=1800):
-        await asyncio.sleep(timer)
-        del self.mem[key][id]
-        logging.info(f'Successfully deleted {id} from cache')
+    def load(self, con):
+        '''Warm the cache with the persisted records'''
+        expires = time.monotonic() + self.ttl
+        for key, (table, record) in self.records.items():
+            for row in con.execute(f'SELECT * FROM {table} LIMIT ?', (self.size,)):
+                self.mem[key][row[0]] = (expires, record(*row))
+            logging.info(f'Loaded {len(self.mem[key])} {table} from {self.dbNAME}')
+
+    def get(self, key, id):
+        entries = self.mem[key]
+        entry = entries.get(id)
+        if entry is None or entry[0] <= time.monotonic():
+            self.counters['misses'] += 1
+            return None
+        entries.move_to_end(id)
+        self.counters['hits'] += 1
+        return entry[1]
+
+    def set(self, key, id, value):
+        entries = self.mem[key]
+        entries[id] = (time.monotonic() + self.ttl, value)
+        entries.move_to_end(id)
+        while len(entries) > self.size:
+            entries.popitem(last=False)
+            self.counters['evictions'] += 1
+
+        if self.sweeper is None or self.sweeper.done():
+            self.sweeper = asyncio.ensure_future(self.sweep())
+
+        if key in self.records and not isinstance(value, self.records[key][1]):
+            self.dirty[key][id] = self.records[key][1].of(value)
+            if self.writer is None or self.writer.done():
+                self.stopping = asyncio.Event()
+                self.writer = asyncio.ensure_future(self.persist())
+
+    def get_user(self, userid):
+        user = self.get('user', userid)
+        if user is None:
+            user = self.bot.get_user(userid)
+            if user is not None:
+                self.set('user', userid, user)
+        return user
+
+    async def sweep(self):
+        while any(self.mem.values()):
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            for entries in self.mem.values():
+                for id in [id for id, (expires, value) in entries.items() if expires <= now]:
+                    del entries[id]
+                    self.counters['expired'] += 1
+
+    async def persist(self):
+        while any(self.dirty.values()) and not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception:
+                logging.error(traceback.format_exc())
+
+    async def flush(self):
+        '''Write every dirty record to dbNAME in one transaction'''
+        dirty, self.dirty = self.dirty, defaultdict(dict)
+        if not any(dirty.values()):
+            return
+        if self.con is None:
+            self.con = await aiosqlite.connect(self.dbNAME)
+        for key, records in dirty.items():
+            table, record = self.records[key]
+            values = ', '.join('?' for _ in record._fields)
+            await self.con.executemany(f'INSERT OR REPLACE INTO {table} VALUES ({values})', records.values())
+        await self.con.commit()
+
+    async def shutdown(self):
+        if self.writer is not None:
+            #The writer finishes the records it is writing, cancelling it would lose them.
+            self.stopping.set()
+            await self.writer
+            self.writer = None
+        await self.flush()
+        if self.con is not None:
+            await self.con.close()
+            self.con = None
 
     def __repr__(self):
-        return str(self.mem)
+        sizes = ', '.join(f'{key}: {len(entries)}/{self.size}' for key, entries in self.mem.items())
+        counters = ', '.join(f'{name}={self.counters[name]}' for name in ('hits', 'misses', 'evictions', 'expired'))
+        return f'Cache({sizes}; {counters})'
 
 class DBHandler:
     '''
@@ -47,35 +189,186 @@ class DBHandler:
     win/loss:
 
     for any game.
+
+    Reads (leaderboard, stats) are served from the [reads] cache, which
+    a flush invalidates for every game it wrote to. It keeps the [reads_size]
+    most recently used reads. Worker processes and other shards write through
+    their own connections, so a read first checks the data_version of the
+    database and drops the cached reads of a game someone else wrote to.
+
+    Writes are write-behind: incr only queues the update, a single writer task
+    folds queued updates into one UPSERT transaction per database, on one long-lived
+    WAL connection per database. The queue is flushed when [batch] updates are queued,
+    every [interval] seconds, and on shutdown.
     '''
     games = {'acro': 'acro.db', 
              'boggle': 'boggle.db'}
+    columns = ('wins', 'losses')
+    #Expressions the leaderboard can be ordered by, each one is indexed.
+    orders = {'wins': 'wins',
+              'losses': 'losses',
+              'ratio': 'CAST(wins AS REAL) / MAX(losses, 1)'}
+
+    batch = 256
+    interval = 5
+
+    upsert = '''INSERT INTO statistics (userid, wins, losses) VALUES (?, ?, ?)
+                ON CONFLICT(userid) DO UPDATE SET wins = wins + excluded.wins,
+                                                  losses = losses + excluded.losses'''
+
+    pending = []
+    #key: rows, oldest use first
+    reads = OrderedDict()
+    reads_size = 1000
+    #game: PRAGMA data_version its cached reads were read at
+    versions = {}
+    connections = {}
+    _flush = None
+    _writer = None
+    _stopping = False
 
     @classmethod
     def startup(cls):
         for game in cls.games.values():
             with sqlite3.connect(f'db/{game}') as con:
+                con.execute('PRAGMA journal_mode=WAL')
                 con.execute(f'''CREATE TABLE IF NOT EXISTS statistics
                 (userid INTEGER PRIMARY KEY, wins INTEGER, losses INTEGER)''')
+                for order, expression in cls.orders.items():
+                    con.execute(f'''CREATE INDEX IF NOT EXISTS statistics_{order}
+                                ON statistics({expression} DESC)''')
 
     @classmethod
     async def incr(cls, name, col, users):
-        async with aiosqlite.connect(f'db/{cls.games[name]}') as con:
+        '''Queue +1 to [col] of every user in [users], a list of ids or of (id, score)'''
+        with metrics.timer('referee_db_incr_seconds'):
+            if name not in cls.games or col not in cls.columns:
+                raise ValueError(f'Unknown statistic {name}.{col}')
             for user in users:
                 try: user = user[0] 
-                except IndexError: pass
-                row = await con.execute(f'''SELECT * FROM statistics
-                                            WHERE userid=?''', (user,))
-                if await row.fetchone():
-                    await con.execute(f'''UPDATE statistics SET {col} = {col} + 1 
+                except (TypeError, IndexError): pass
+                cls.pending.append((name, col, user))
+
+            if cls._writer is None or cls._writer.done():
+                cls._flush = asyncio.Event()
+                cls._stopping = False
+                cls._writer = asyncio.ensure_future(cls.writer())
+            if len(cls.pending) >= cls.batch:
+                cls._flush.set()
+
+    @classmethod
+    async def writer(cls):
+        while not cls._stopping:
+            try:
+                await asyncio.wait_for(cls._flush.wait(), cls.interval)
+            except asyncio.TimeoutError:
+                pass
+            cls._flush.clear()
+            try:
+                await cls.flush()
+            except Exception:
+                logging.error(traceback.format_exc())
+
+    @classmethod
+    async def flush(cls):
+        '''Write every queued update, one transaction per database'''
+        batch, cls.pending = cls.pending, []
+        if not batch:
+            return
+        with metrics.timer('referee_db_flush_seconds'):
+            await cls.write(batch)
+
+    @classmethod
+    async def write(cls, batch):
+        rows = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+        for name, col, user in batch:
+            rows[name][user][cls.columns.index(col)] += 1
+
+        for name, users in rows.items():
+            con = await cls.connect(name)
+            await con.executemany(cls.upsert, [(user, wins, losses) for user, (wins, losses) in users.items()])
+            await con.commit()
+            cls.invalidate(name)
+
+    @classmethod
+    def invalidate(cls, name):
+        for key in [key for key in cls.reads if key[0] == name]:
+            del cls.reads[key]
+
+    @classmethod
+    async def refresh(cls, name):
+        '''Invalidate the reads of [name] if another connection committed to it since they were read'''
+        con = await cls.connect(name)
+        cursor = await con.execute('PRAGMA data_version')
+        version, = await cursor.fetchone()
+        if cls.versions.get(name) != version:
+            cls.versions[name] = version
+            cls.invalidate(name)
+
+    @classmethod
+    def cached(cls, key):
+        '''The cached read of [key], None if it is not cached'''
+        if key not in cls.reads:
+            return None
+        cls.reads.move_to_end(key)
+        return cls.reads[key]
+
+    @classmethod
+    def cache(cls, key, rows):
+        cls.reads[key] = rows
+        while len(cls.reads) > cls.reads_size:
+            cls.reads.popitem(last=False)
+        return rows
+
+    @classmethod
+    async def leaderboard(cls, name, order='wins', limit=10):
+        '''Top [limit] rows (userid, wins, losses) of [name], ordered by [order]'''
+        key = (name, 'leaderboard', order, limit)
+        await cls.refresh(name)
+        rows = cls.cached(key)
+        if rows is None:
+            con = await cls.connect(name)
+            cursor = await con.execute(f'''SELECT userid, wins, losses FROM statistics
+                                        ORDER BY {cls.orders[order]} DESC LIMIT ?''', (limit,))
+            rows = cls.cache(key, await cursor.fetchall())
+        return rows
+
+    @classmethod
+    async def stats(cls, name, user):
+        '''(wins, losses) of [user] in [name]'''
+        key = (name, 'stats', user)
+        await cls.refresh(name)
+        row = cls.cached(key)
+        if row is None:
+            con = await cls.connect(name)
+            cursor = await con.execute('''SELECT wins, losses FROM statistics
                                         WHERE userid=?''', (user,))
-                else:
-                    await con.execute('''INSERT INTO statistics (userid, wins, losses)
-                                     VALUES (?, ?, ?)''', 
-                                    (user, int(col == 'wins'), int(col == 'losses')))
-                await con.commit()
+            row = cls.cache(key, await cursor.fetchone() or (0, 0))
+        return row
 
-            
+    @classmethod
+    async def connect(cls, name):
+        if name not in cls.connections:
+            con = await aiosqlite.connect(f'db/{cls.games[name]}')
+            await con.execute('PRAGMA journal_mode=WAL')
+            await con.execute('PRAGMA synchronous=NORMAL')
+            cls.connections[name] = con
+        return cls.connections[name]
+
+    @classmethod
+    async def shutdown(cls):
+        '''Flush the queue and close every connection'''
+        if cls._writer is not None:
+            #The writer finishes the batch it is writing, cancelling it would lose the batch.
+            cls._stopping = True
+            cls._flush.set()
+            await cls._writer
+            cls._writer = None
+        await cls.flush()
+        for con in cls.connections.values():
+            await con.close()
+        cls.connections.clear()
+        cls.versions.clear()
 
 if __name__ == '__main__':
     pass
\ No newline at end of file
@@ -0,0 +1,234 @@
+import aiosqlite
+import asyncio
+import json
+import logging
+import os
+import socket
+import sql
+import sqlite3
+import time
+import traceback
+
+from collections import defaultdict
+from router import Router
+
+class LocalState():
+    '''
+    Which channels have a game, and what they are flagged with, when one bot process
+    runs every game. The store RefBot claims channels and flags games through:
+
+        claim(channel, game): take [channel] for [game], False if a game already has it
+        release(channel)
+        flag(channel, flag, key) / unflag(channel, flag): key is the dm key of a DMable game
+        forward(user, content): hand a DM to the DMable games of the other processes it fits
+
+    The instances themselves stay in RefBot.games and the router, this is only about
+    what the other processes need to know.
+    '''
+    shared = False
+    owner = 'local'
+
+    def __init__(self):
+        #channel id: game
+        self.games = {}
+        #flag: {channel id: key}
+        self.flags = defaultdict(dict)
+
+    async def claim(self, channel, game):
+        if channel in self.games:
+            return False
+        self.games[channel] = game
+        return True
+
+    async def release(self, channel):
+        self.games.pop(channel, None)
+
+    async def flag(self, channel, flag, key=None):
+        self.flags[flag][channel] = key
+
+    async def unflag(self, channel, flag):
+        self.flags[flag].pop(channel, None)
+
+    async def forward(self, user, content):
+        '''There are no other processes'''
+        return 0
+
+    async def close(self):
+        pass
+
+    def __repr__(self):
+        return f'LocalState(games={len(self.games)}, flags={ {flag: len(channels) for flag, channels in self.flags.items()} })'
+
+class SharedState(LocalState):
+    '''
+    Games and flags shared by several bot processes, eg. one per shard, through one SQLite
+    database in WAL mode at [path]. Every process sharing it must reach the same file.
+
+    Each process is an [owner], its claims and flags are rows tagged with it. It marks itself
+    alive every [heartbeat] seconds, and the rows of an owner not seen for [timeout] seconds
+    are free to take again. A process also drops its own rows when it starts and closes.
+
+    DMs only reach one process. A DM that fits the initials of a DMable game of another
+    process goes into the forwards table, which each owner polls every [poll] seconds while
+    it has DMable games, and is played there through [deliver](channel, user, content).
+    The DMable keys of the other processes are read through a local copy that is at most
+    [ttl] seconds old, so most DMs cost a dict lookup.
+    '''
+    shared = True
+    path = 'db/state.db'
+    ttl = 1.0
+    heartbeat = 5
+    timeout = 30
+    poll = 0.05
+    #The owners that are not timed out, given the time they must have been seen since.
+    alive = 'SELECT owner FROM owners WHERE seen >= ?'
+
+    schema = ('CREATE TABLE IF NOT EXISTS owners (owner TEXT PRIMARY KEY, seen REAL)',
+              'CREATE TABLE IF NOT EXISTS games (channel INTEGER PRIMARY KEY, owner TEXT, game TEXT)',
+              '''CREATE TABLE IF NOT EXISTS flags (channel INTEGER, flag TEXT, key TEXT, owner TEXT,
+                                                   PRIMARY KEY (channel, flag))''',
+              '''CREATE TABLE IF NOT EXISTS forwards (id INTEGER PRIMARY KEY, owner TEXT, channel INTEGER,
+                                                      user TEXT, content TEXT)''',
+              'CREATE INDEX IF NOT EXISTS forwards_owner ON forwards(owner)')
+
+    @staticmethod
+    def startup(deliver, owner=None, path=None):
+        state = SharedState(deliver, owner, path)
+        with sqlite3.connect(state.path) as con:
+            con.execute('PRAGMA journal_mode=WAL')
+            for statement in state.schema:
+                con.execute(statement)
+            #What a previous run of this owner left is stale.
+            state.drop(con)
+        logging.info(f'Sharing games through {state.path} as {state.owner}')
+        return state
+
+    def __init__(self, deliver, owner=None, path=None):
+        super().__init__()
+        self.deliver = deliver
+        self.owner = owner or f'{socket.gethostname()}:{os.getpid()}'
+        self.path = path or self.path
+        self.con = None
+        self.beater = None
+        self.poller = None
+        #key: {channel id: owner}, the DMable games of the other processes
+        self.remote = {}
+        self.read = float('-inf')
+        self.refresher = None
+
+    def drop(self, con):
+        for table in ('owners', 'games', 'flags', 'forwards'):
+            con.execute(f'DELETE FROM {table} WHERE owner = ?', (self.owner,))
+
+    async def connect(self):
+        if self.con is None:
+            self.con = await aiosqlite.connect(self.path, timeout=self.timeout)
+            await self.beat()
+            self.beater = asyncio.ensure_future(self.beating())
+        return self.con
+
+    async def beat(self):
+        await self.con.execute('INSERT OR REPLACE INTO owners VALUES (?, ?)', (self.owner, time.time()))
+        await self.con.commit()
+
+    async def beating(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                await self.beat()
+            except Exception:
+                logging.error(traceback.format_exc())
+
+    async def claim(self, channel, game):
+        con = await self.connect()
+        await con.execute(f'DELETE FROM games WHERE channel = ? AND owner NOT IN ({self.alive})',
+                          (channel, time.time() - self.timeout))
+        cursor = await con.execute('INSERT OR IGNORE INTO games VALUES (?, ?, ?)', (channel, self.owner, game))
+        await con.commit()
+        if cursor.rowcount != 1:
+            return False
+        self.games[channel] = game
+        return True
+
+    async def release(self, channel):
+        self.games.pop(channel, None)
+        con = await self.connect()
+        await con.execute('DELETE FROM games WHERE channel = ? AND owner = ?', (channel, self.owner))
+        await con.commit()
+
+    async def flag(self, channel, flag, key=None):
+        await super().flag(channel, flag, key)
+        con = await self.connect()
+        await con.execute('INSERT OR REPLACE INTO flags VALUES (?, ?, ?, ?)', (channel, flag, key, self.owner))
+        await con.commit()
+        if flag == 'DMable' and (self.poller is None or self.poller.done()):
+            self.poller = asyncio.ensure_future(self.polling())
+
+    async def unflag(self, channel, flag):
+        await super().unflag(channel, flag)
+        con = await self.connect()
+        await con.execute('DELETE FROM flags WHERE channel = ? AND flag = ? AND owner = ?', (channel, flag, self.owner))
+        await con.commit()
+
+    async def dms(self, key):
+        '''{channel id: owner} of the DMable games of other processes for [key], read through [remote]'''
+        if time.monotonic() - self.read > self.ttl:
+            if self.refresher is None or self.refresher.done():
+                self.refresher = asyncio.ensure_future(self.refresh())
+            await asyncio.shield(self.refresher)
+        return self.remote.get(key)
+
+    async def refresh(self):
+        con = await self.connect()
+        remote = defaultdict(dict)
+        async with con.execute(f'''SELECT key, channel, owner FROM flags
+                                   WHERE flag = 'DMable' AND owner != ? AND owner IN ({self.alive})''',
+                               (self.owner, time.time() - self.timeout)) as cursor:
+            async for key, channel, owner in cursor:
+                remote[key][channel] = owner
+        self.remote = remote
+        self.read = time.monotonic()
+
+    async def forward(self, user, content):
+        '''Forward a DM of [content] from [user] to the games of other processes it fits, how many'''
+        games = await self.dms(Router.phrase_key(content))
+        if not games:
+            return 0
+        record = json.dumps(sql.CachedUser.of(user))
+        con = await self.connect()
+        await con.executemany('INSERT INTO forwards (owner, channel, user, content) VALUES (?, ?, ?, ?)',
+                                   [(owner, channel, record, content) for channel, owner in games.items()])
+        await con.commit()
+        return len(games)
+
+    async def polling(self):
+        '''Deliver the forwarded DMs while this process has DMable games'''
+        while self.flags['DMable']:
+            await asyncio.sleep(self.poll)
+            try:
+                async with self.con.execute('SELECT id, channel, user, content FROM forwards WHERE owner = ?',
+                                            (self.owner,)) as cursor:
+                    rows = await cursor.fetchall()
+                if not rows:
+                    continue
+                await self.con.execute('DELETE FROM forwards WHERE owner = ? AND id <= ?', (self.owner, rows[-1][0]))
+                await self.con.commit()
+                for _, channel, user, content in rows:
+                    self.deliver(channel, json.loads(user), content)
+            except Exception:
+                logging.error(traceback.format_exc())
+
+    async def close(self):
+        for task in (self.beater, self.poller, self.refresher):
+            if task is not None:
+                task.cancel()
+        if self.con is not None:
+            await self.con.close()
+            self.con = None
+        with sqlite3.connect(self.path) as con:
+            self.drop(con)
+
+    def __repr__(self):
+        return (f'SharedState({self.path}, {self.owner}, games={len(self.games)}, '
+                f'flags={ {flag: len(channels) for flag, channels in self.flags.items()} }, '
+                f'remote dm keys={len(self.remote)})')
@@ -11,13 +11,13 @@ def flagger(*flags):
         @wraps(func)
         async def wrapper(self, *args, **kwargs):
             for flag in flags:
-                self.bot.flags[flag].add(self.ctx.message.channel.id)
+                await self.bot.add_flag(self, flag)
                 logging.info(f'Flagging {self} with {flag}')
             try:
                 result = await func(self, *args, **kwargs)
             finally:
                 for flag in flags:
-                    self.bot.flags[flag].remove(self.ctx.message.channel.id)
+                    await self.bot.remove_flag(self, flag)
                     logging.info(f'Unflagged {flag} from {self}')
 
             return result
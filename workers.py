@@ -0,0 +1,395 @@
+'''
+Game workers, to spread instances over several processes.
+
+The gateway (RefBot) keeps the discord connection, the registry and the router. Each game runs
+in a worker process, and the gateway registers a RemoteInstance in its place. Every message
+over the pipes is a tuple, the first item says what it is:
+
+    gateway -> worker
+        ('start', game, channel id, author, config)
+        ('call', channel id, method, user, user id, *args)    a play, vote or unvote
+        ('sent', token, message id, error)                    reply to 'send'
+        ('stop',)
+    worker -> gateway
+        ('send', token, channel id, content)
+        ('react', channel id, message id, emoji)
+        ('flag', channel id, flag, added, key)                dm key, or ballot of a votable game
+        ('over', channel id)                                  the game ended, every message is sent
+        ('metrics', histograms)                               see metrics.Registry.drain
+
+Users travel as sql.CachedUser records, which the worker puts in its cache.
+'''
+import asyncio
+import games
+import itertools
+import library
+import logging
+import metrics
+import multiprocessing
+import pool
+import scheduler
+import sql
+import traceback
+
+from collections import defaultdict, OrderedDict
+from outbox import Outbox
+
+def record(user):
+    if user is None or isinstance(user, sql.CachedUser):
+        return user
+    return sql.CachedUser.of(user)
+
+###################################
+#Gateway side
+###################################
+class RemoteInstance():
+    '''What the gateway registers and routes to, for an instance running in [worker]'''
+    def __init__(self, worker, ctx, name):
+        self.worker = worker
+        self.ctx = ctx
+        self.name = name
+        self.key = None
+        self.ballot = None
+        self.over = asyncio.Event()
+
+    def play(self, userid, content):
+        self.worker.call(self, 'play', userid, content)
+
+    def vote(self, userid, *args):
+        self.worker.call(self, 'vote', userid, *args)
+
+    def unvote(self, userid, *args):
+        self.worker.call(self, 'unvote', userid, *args)
+
+    def dm_key(self):
+        return self.key
+
+    def ballot_key(self):
+        return self.ballot
+
+    def __repr__(self):
+        return f'{self.ctx.message.channel.id} {self.name}: worker({self.worker.index})'
+
+class Worker():
+    '''One worker process and the gateway's end of its pipe'''
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.instances = {}
+        self.stopping = False
+
+        context = multiprocessing.get_context('spawn')
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=main, args=(child,), name=f'referee-worker-{index}')
+        self.process.start()
+        child.close()
+        asyncio.get_event_loop().add_reader(self.conn.fileno(), self.receive)
+
+    def send(self, *message):
+        try:
+            self.conn.send(message)
+        except OSError:
+            logging.error(traceback.format_exc())
+
+    def call(self, instance, method, userid, *args):
+        user = self.pool.bot.cache.get_user(userid)
+        self.send('call', instance.ctx.message.channel.id, method, record(user), userid, *args)
+
+    def receive(self):
+        try:
+            while self.conn.poll():
+                message = self.conn.recv()
+                asyncio.ensure_future(self.pool.handle(self, *message))
+        except (EOFError, OSError):
+            if not self.stopping:
+                logging.error(f'Worker {self.index} is gone, ending its {len(self.instances)} games')
+            self.close()
+            for instance in list(self.instances.values()):
+                asyncio.ensure_future(self.pool.over(self, instance.ctx.message.channel.id))
+
+    def close(self):
+        if not self.conn.closed:
+            asyncio.get_event_loop().remove_reader(self.conn.fileno())
+            self.conn.close()
+
+    def __repr__(self):
+        return f'Worker({self.index}, pid={self.process.pid}, alive={self.process.is_alive()}, games={len(self.instances)})'
+
+class WorkerPool():
+    '''
+    [workers] worker processes for the games of [bot], started on the first game.
+    Each new game goes to the worker with the fewest games.
+
+    Messages are paced and coalesced by the outbox of the worker, the gateway only sends
+    them with the transport of bot.outbox. The last [remember] sent messages are kept so
+    workers can react to them by id.
+    '''
+    remember = 1024
+
+    def __init__(self, bot, workers):
+        self.bot = bot
+        self.size = workers
+        self.workers = []
+        self.messages = OrderedDict()
+
+    async def start(self, game, ctx, config=None):
+        '''Run [game] in a worker until it is over'''
+        if not self.workers:
+            self.workers = [Worker(self, index) for index in range(self.size)]
+
+        worker = min(self.workers, key=lambda worker: len(worker.instances))
+        instance = RemoteInstance(worker, ctx, game)
+        channel = ctx.message.channel.id
+        try:
+            await self.bot.register(instance)
+        except games.ActiveGame as e:
+            #Another bot process runs a game there.
+            self.bot.outbox.send(ctx, e)
+            return
+        worker.instances[channel] = instance
+        worker.send('start', game, channel, record(ctx.author), config)
+        await instance.over.wait()
+
+    async def handle(self, worker, kind, *args):
+        try:
+            await getattr(self, kind)(worker, *args)
+        except Exception:
+            logging.error(traceback.format_exc())
+
+    async def send(self, worker, token, channel, content):
+        instance = worker.instances.get(channel)
+        try:
+            message = await self.bot.outbox.transport.send(instance.ctx, content)
+        except Exception as e:
+            worker.send('sent', token, None, repr(e))
+            raise
+        self.messages[message.id] = message
+        while len(self.messages) > self.remember:
+            self.messages.popitem(last=False)
+        worker.send('sent', token, message.id, None)
+
+    async def react(self, worker, channel, message, emoji):
+        message = self.messages.get(message)
+        if message is not None:
+            await self.bot.outbox.transport.react(message, emoji)
+
+    async def flag(self, worker, channel, flag, added, key):
+        instance = worker.instances[channel]
+        if added:
+            if flag == 'DMable':
+                instance.key = key
+            elif flag == 'votable':
+                instance.ballot = key
+            await self.bot.add_flag(instance, flag)
+        else:
+            await self.bot.remove_flag(instance, flag)
+
+    async def over(self, worker, channel):
+        instance = worker.instances.pop(channel, None)
+        if instance is None:
+            return
+        #A copy, other games flag and unflag while this awaits.
+        flags = [flag for flag, channels in list(self.bot.flags.items()) if channel in channels]
+        try:
+            for flag in flags:
+                await self.bot.remove_flag(instance, flag)
+        finally:
+            await self.bot.unregister(instance)
+            instance.over.set()
+
+    async def metrics(self, worker, histograms):
+        metrics.registry.merge(histograms)
+
+    async def close(self, timeout=5):
+        loop = asyncio.get_event_loop()
+        for worker in self.workers:
+            worker.stopping = True
+            worker.send('stop')
+        for worker in self.workers:
+            await loop.run_in_executor(None, worker.process.join, timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.close()
+        self.workers = []
+
+    def __repr__(self):
+        return f'WorkerPool({self.size}, {self.workers})'
+
+###################################
+#Worker side
+###################################
+class RemoteChannel():
+    def __init__(self, id):
+        self.id = id
+
+class RemoteMessage():
+    def __init__(self, id, channel):
+        self.id = id
+        self.channel = channel
+
+class RemoteContext():
+    '''All an instance uses of its context'''
+    def __init__(self, channel, author):
+        self.channel = RemoteChannel(channel)
+        self.author = author
+        self.message = RemoteMessage(None, self.channel)
+
+class PipeTransport():
+    '''Outbox transport of a worker, the gateway sends for it'''
+    def __init__(self, conn):
+        self.conn = conn
+        self.tokens = itertools.count()
+        self.pending = {}
+
+    async def send(self, target, content):
+        channel = getattr(target, 'channel', target)
+        token = next(self.tokens)
+        self.pending[token] = asyncio.get_event_loop().create_future()
+        self.conn.send(('send', token, channel.id, content))
+        return RemoteMessage(await self.pending[token], channel)
+
+    async def react(self, message, emoji):
+        self.conn.send(('react', message.channel.id, message.id, emoji))
+
+    def sent(self, token, message, error):
+        future = self.pending.pop(token, None)
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(RuntimeError(error))
+        else:
+            future.set_result(message)
+
+class WorkerBot():
+    '''The part of RefBot the instances use, inside a worker process'''
+    workers = None
+    journal = None
+    #Seconds between sending the metrics of the worker to the gateway
+    report_interval = 5
+    #method: the flags an instance needs to be called with it, like the router of the gateway
+    accepts = {'play': ('playable', 'DMable'),
+               'vote': ('votable',),
+               'unvote': ('votable',)}
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.games = {}
+        self.flags = defaultdict(set)
+        self.transport = PipeTransport(conn)
+        self.outbox = Outbox(self.transport)
+        #Solve in the background so the games of this worker keep going meanwhile.
+        self.boards = pool.BoardPool(workers=1)
+        self.library = library.BoardLibrary()
+        self.scheduler = scheduler.Scheduler()
+        self.cache = sql.Cache(self)
+        self.cog = games.Games(self)
+        self.tasks = {}
+        self.stopped = asyncio.Event()
+
+    def get_user(self, userid):
+        '''Users only come from the gateway'''
+        return None
+
+    async def register(self, instance):
+        self.games[instance.ctx.message.channel.id] = instance
+
+    async def unregister(self, instance):
+        del self.games[instance.ctx.message.channel.id]
+
+    async def add_flag(self, instance, flag):
+        channel = instance.ctx.message.channel.id
+        self.flags[flag].add(channel)
+        key = None
+        if flag == 'DMable':
+            key = instance.dm_key()
+        elif flag == 'votable':
+            key = instance.ballot_key()
+        self.conn.send(('flag', channel, flag, True, key))
+
+    async def remove_flag(self, instance, flag):
+        channel = instance.ctx.message.channel.id
+        self.flags[flag].remove(channel)
+        self.conn.send(('flag', channel, flag, False, None))
+
+    def receive(self):
+        try:
+            while self.conn.poll():
+                kind, *args = self.conn.recv()
+                getattr(self, f'on_{kind}')(*args)
+        except (EOFError, OSError):
+            self.stopped.set()
+        except Exception:
+            logging.error(traceback.format_exc())
+
+    def on_start(self, game, channel, author, config):
+        self.cache.set('user', author.id, author)
+        self.tasks[channel] = asyncio.ensure_future(self.run(game, RemoteContext(channel, author), config))
+
+    def on_call(self, channel, method, user, userid, *args):
+        if user is not None:
+            self.cache.set('user', userid, user)
+        instance = self.games.get(channel)
+        #The gateway may not know yet that a phase ended, what reaches an instance outside it is dropped.
+        if instance is not None and any(channel in self.flags[flag] for flag in self.accepts.get(method, ())):
+            getattr(instance, method)(userid, *args)
+
+    def on_sent(self, token, message, error):
+        self.transport.sent(token, message, error)
+
+    def on_stop(self):
+        self.stopped.set()
+
+    def report(self):
+        '''The gateway exports the metrics, the worker only sends it what it observed'''
+        histograms = metrics.registry.drain()
+        if histograms:
+            self.conn.send(('metrics', histograms))
+
+    async def reporting(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            try:
+                self.report()
+            except OSError:
+                logging.error(traceback.format_exc())
+
+    async def run(self, game, ctx, config):
+        channel = ctx.message.channel.id
+        try:
+            await self.cog.start(game, ctx, config)
+            #Everything the game said goes out before the gateway hears it is over.
+            drainer = self.outbox.drainers.get(channel)
+            if drainer is not None:
+                await asyncio.shield(drainer)
+        finally:
+            del self.tasks[channel]
+            self.conn.send(('over', channel))
+
+    async def close(self):
+        for task in list(self.tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        self.boards.close()
+        await self.library.close()
+        if self.cache.sweeper is not None:
+            self.cache.sweeper.cancel()
+        await self.cache.shutdown()
+        await sql.DBHandler.shutdown()
+        try:
+            self.report()
+        except OSError:
+            pass
+
+def main(conn):
+    '''Entry point of a worker process, runs until the gateway says stop or goes away'''
+    logging.basicConfig(level=logging.WARNING)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    sql.DBHandler.startup()
+    bot = WorkerBot(conn)
+    loop.add_reader(conn.fileno(), bot.receive)
+    reporter = loop.create_task(bot.reporting())
+    loop.run_until_complete(bot.stopped.wait())
+    reporter.cancel()
+    loop.run_until_complete(bot.close())
+    loop.close()